@@ -38,6 +38,13 @@ else
     endif
 endif
 
+" Calling into Python through pyeval() avoids executing a command string.
+if g:_uspy == ":py3 "
+    let g:_uspyeval = exists("*py3eval") ? "py3eval" : ""
+else
+    let g:_uspyeval = exists("*pyeval") ? "pyeval" : ""
+endif
+
 " Global Variables {{{
 
 " The trigger used to expand a snippet.
@@ -112,7 +119,7 @@ command! -nargs=? -complete=customlist,UltiSnipsFiletypeComplete UltiSnipsEdit
 
 " Global Commands {{{
 function! UltiSnipsAddFiletypes(filetypes)
-    exec g:_uspy "UltiSnips_Manager.add_buffer_filetypes('" . a:filetypes . ".all')"
+    call s:Call("add_buffer_filetypes", [a:filetypes . ".all"])
     return ""
 endfunction
 command! -nargs=1 UltiSnipsAddFiletypes :call UltiSnipsAddFiletypes(<q-args>)
@@ -120,78 +127,84 @@ command! -nargs=1 UltiSnipsAddFiletypes :call UltiSnipsAddFiletypes(<q-args>)
 "" }}}
 
 " FUNCTIONS {{{
+function! s:Call(name, args)
+    " Calls the method name of UltiSnips_Manager with the list args. The
+    " Python side fetches name and args with a single vim.eval and returns
+    " an expression that we should return, mostly to play well with
+    " SuperTab.
+    let l:call = [a:name, a:args]
+    " Stays empty if UltiSnips_Call raises.
+    let l:rv = ""
+    if g:_uspyeval != ""
+        let l:rv = call(g:_uspyeval, ["UltiSnips_Call()"])
+    else
+        exec g:_uspy "UltiSnips_Call(True)"
+    endif
+    if l:rv == ""
+        return ""
+    endif
+    return eval(l:rv)
+endfunction
+
 function! CompensateForPUM()
     """ The CursorMovedI event is not triggered while the popup-menu is visible,
     """ and it's by this event that UltiSnips updates its vim-state. The fix is
     """ to explicitly check for the presence of the popup menu, and update
     """ the vim-state accordingly.
-    if pumvisible()
-        exec g:_uspy "UltiSnips_Manager.cursor_moved()"
+    if pumvisible() && getbufvar('%', '_ulti_snippet_active')
+        call s:Call("cursor_moved", [])
     endif
 endfunction
 function! UltiSnips_ExpandSnippet()
-    exec g:_uspy "UltiSnips_Manager.expand()"
-    return ""
+    return s:Call("expand", [])
 endfunction
 
 function! UltiSnips_ExpandSnippetOrJump()
     call CompensateForPUM()
-    exec g:_uspy "UltiSnips_Manager.expand_or_jump()"
-    return ""
+    return s:Call("expand_or_jump", [])
 endfunction
 
 function! UltiSnips_ListSnippets()
-    exec g:_uspy "UltiSnips_Manager.list_snippets()"
-    return ""
+    return s:Call("list_snippets", [])
 endfunction
 
 function! UltiSnips_SnippetsInCurrentScope()
     let g:current_ulti_dict = {}
-    exec g:_uspy "UltiSnips_Manager.list_snippets_dict()"
+    call s:Call("list_snippets_dict", [])
     return g:current_ulti_dict
 endfunction
 
 function! UltiSnips_SaveLastVisualSelection()
-    exec g:_uspy "UltiSnips_Manager.save_last_visual_selection()"
-    return ""
+    return s:Call("save_last_visual_selection", [])
 endfunction
 
 function! UltiSnips_JumpBackwards()
     call CompensateForPUM()
-    exec g:_uspy "UltiSnips_Manager.jump_backwards()"
-    return ""
+    return s:Call("jump_backwards", [])
 endfunction
 
 function! UltiSnips_JumpForwards()
     call CompensateForPUM()
-    exec g:_uspy "UltiSnips_Manager.jump_forwards()"
-    return ""
+    return s:Call("jump_forwards", [])
 endfunction
 
 function! UltiSnips_FileTypeChanged()
-    exec g:_uspy "UltiSnips_Manager.reset_buffer_filetypes()"
-    exec g:_uspy "UltiSnips_Manager.add_buffer_filetypes('" . &ft . "')"
+    call s:Call("reset_buffer_filetypes", [])
+    call s:Call("add_buffer_filetypes", [&ft])
     return ""
 endfunction
 
 function! UltiSnips_AddSnippet(trigger, value, descr, options, ...)
     " Takes the same arguments as SnippetManager.add_snippet:
     " (trigger, value, descr, options, ft = "all", globals = None)
-    exec g:_uspy "args = vim.eval(\"a:000\")"
-    exec g:_uspy "trigger = vim.eval(\"a:trigger\")"
-    exec g:_uspy "value = vim.eval(\"a:value\")"
-    exec g:_uspy "descr = vim.eval(\"a:descr\")"
-    exec g:_uspy "options = vim.eval(\"a:options\")"
-    exec g:_uspy "UltiSnips_Manager.add_snippet(trigger, value, descr, options, *args)"
+    call s:Call("add_snippet", [a:trigger, a:value, a:descr, a:options] + a:000)
     return ""
 endfunction
 
 function! UltiSnips_Anon(value, ...)
     " Takes the same arguments as SnippetManager.expand_anon:
     " (value, trigger="", descr="", options="", globals = None)
-    exec g:_uspy "args = vim.eval(\"a:000\")"
-    exec g:_uspy "value = vim.eval(\"a:value\")"
-    exec g:_uspy "UltiSnips_Manager.expand_anon(value, *args)"
+    call s:Call("expand_anon", [a:value] + a:000)
     return ""
 endfunction
 
@@ -219,13 +232,25 @@ function! UltiSnips_MapKeys()
 endf
 
 function! UltiSnips_CursorMoved()
-    exec g:_uspy "UltiSnips_Manager.cursor_moved()"
+    call s:Call("cursor_moved", [])
 endf
-function! UltiSnips_EnteredInsertMode()
-    exec g:_uspy "UltiSnips_Manager.entered_insert_mode()"
+function! UltiSnips_TrackCursor(bufnr, active)
+    """ Cursor movements only matter while a snippet is active in a buffer,
+    """ so we only listen for them then.
+    call setbufvar(a:bufnr, '_ulti_snippet_active', a:active)
+    augroup UltiSnips_TrackCursor
+        exec 'au! * <buffer=' . a:bufnr . '>'
+        if a:active
+            exec 'au CursorMovedI <buffer=' . a:bufnr . '> call UltiSnips_CursorMoved()'
+            exec 'au CursorMoved <buffer=' . a:bufnr . '> call UltiSnips_CursorMoved()'
+        endif
+    augroup END
 endf
 function! UltiSnips_LeavingBuffer()
-    exec g:_uspy "UltiSnips_Manager.leaving_buffer()"
+    call s:Call("leaving_buffer", [])
+endf
+function! UltiSnips_OptionChanged(name)
+    call s:Call("option_changed", [a:name])
 endf
 " }}}
 " COMPLETE FUNCTIONS {{{
@@ -254,14 +279,24 @@ exec g:_uspy "import vim, os, sys"
 exec g:_uspy "new_path = vim.eval('expand(\"<sfile>:h\")')"
 exec g:_uspy "vim.command(\"let g:UltiSnipsPythonPath = '%s'\" % new_path)"
 exec g:_uspy "sys.path.append(new_path)"
-exec g:_uspy "from UltiSnips import UltiSnips_Manager"
+exec g:_uspy "from UltiSnips import UltiSnips_Manager, UltiSnips_Call"
 exec g:_uspy "UltiSnips_Manager.expand_trigger = vim.eval('g:UltiSnipsExpandTrigger')"
 exec g:_uspy "UltiSnips_Manager.forward_trigger = vim.eval('g:UltiSnipsJumpForwardTrigger')"
 exec g:_uspy "UltiSnips_Manager.backward_trigger = vim.eval('g:UltiSnipsJumpBackwardTrigger')"
 
-au CursorMovedI * call UltiSnips_CursorMoved()
-au CursorMoved * call UltiSnips_CursorMoved()
 au BufLeave * call UltiSnips_LeavingBuffer()
+" Select mode mappings are only looked at again after these events, see
+" _unmap_select_mode_mapping in UltiSnips/_vim.py.
+let g:_ulti_mappings_tick = 0
+au BufEnter,FileType,SourcePre * let g:_ulti_mappings_tick += 1
+if exists('##CmdlineLeave')
+    au CmdlineLeave : let g:_ulti_mappings_tick += 1
+endif
+if exists('##OptionSet')
+    " Keep in sync with WATCHED_OPTIONS and INDENT_OPTIONS in UltiSnips/_vim.py
+    au OptionSet encoding,runtimepath,langmap,shiftwidth,softtabstop,expandtab,tabstop
+                \ call UltiSnips_OptionChanged(expand('<amatch>'))
+endif
 
 call UltiSnips_MapKeys()
 
@@ -3,16 +3,23 @@
 
 from functools import wraps
 from collections import deque, defaultdict
-import glob
-import hashlib
+import itertools
 import os
 import re
 import traceback
 
-from UltiSnips.compatibility import as_unicode, byte2col
+from UltiSnips.compatibility import as_unicode, as_vimencoding, byte2col, \
+        file_lines
 from UltiSnips._diff import diff, guess_edit
+from UltiSnips._file_tracker import DirectoryCache, FileTracker, digest, \
+        stat_signature
+from UltiSnips._file_watcher import SnippetFileWatcher
+from UltiSnips._snippet_cache import SnippetFileCache, default_cache_dir
+from UltiSnips._snippet_view import ResolvedView
 from UltiSnips.geometry import Position
 from UltiSnips.text_objects import SnippetInstance
+from UltiSnips._trigger_index import TriggerIndex, regex_at_end, \
+        words_for_line
 from UltiSnips.util import IndentUtil
 import UltiSnips._vim as _vim
 
@@ -34,30 +41,75 @@ Following is the full stack trace:
             _vim.new_scratch_buffer(s)
     return wrapper
 
+# Every change to any _SnippetDictionary gets a new number from this, so that
+# cached results derived from dictionaries can tell if they are outdated.
+_generations = itertools.count(1)
+
 class _SnippetDictionary(object):
     def __init__(self, *args, **kwargs):
         self._added = []
+        self._index = TriggerIndex()
+        self._next_rank = 0
         self.reset()
 
+    @property
+    def generation(self):
+        """ Changes whenever snippets are added or removed. """
+        return self._generation
+
+    def _changed(self):
+        self._generation = next(_generations)
+
+    @property
+    def end_chars(self):
+        """ See TriggerIndex.end_chars. """
+        return self._index.end_chars
+
     def add_snippet(self, s, fn=None):
         if fn:
             self._snippets.append(s)
+            self._by_file.setdefault(fn, []).append(s)
+            self._index_snippet(s, 1,
+                    self._file_order.setdefault(fn, len(self._file_order)))
 
             if fn not in self.files:
                 self.addfile(fn)
         else:
             self._added.append(s)
+            self._index_snippet(s, 0)
+
+    def _index_snippet(self, s, *group):
+        # Snippets added at runtime come before those from files, which are
+        # kept in the order of their files. Inside each group, the order of
+        # addition is kept.
+        self._index.add(s, group + (self._next_rank,))
+        self._next_rank += 1
+        self._changed()
+
+    def remove_file_snippets(self, fn):
+        """ Removes the snippets that were added from the file fn. """
+        removed = set(self._by_file.pop(fn, ()))
+        if removed:
+            kept = []
+            for s in self._snippets:
+                if s in removed:
+                    self._index.remove(s)
+                else:
+                    kept.append(s)
+            self._snippets = kept
+        self._changed()
 
     def get_matching_snippets(self, trigger, potentially):
         """Returns all snippets matching the given trigger."""
+        candidates = self._index.candidates(trigger, potentially)
         if not potentially:
-            return [ s for s in self.snippets if s.matches(trigger) ]
+            return [ s for s in candidates if s.matches(trigger) ]
         else:
-            return [ s for s in self.snippets if s.could_match(trigger) ]
+            return [ s for s in candidates if s.could_match(trigger) ]
 
     @property
     def snippets(self):
-        return self._added + self._snippets
+        return sorted(self._added + self._snippets, key=self._index.rank)
 
     def clear_snippets(self, triggers=[]):
         """Remove all snippets that match each trigger in triggers.
@@ -70,60 +122,85 @@ class _SnippetDictionary(object):
                         self._snippets.remove(s)
                     if s in self._added:
                         self._added.remove(s)
+                    self._index.remove(s)
         else:
             self._snippets = []
             self._added = []
+            self._index.clear()
+        self._changed()
 
     @property
     def files(self):
         return self._files
 
+    @property
+    def sources(self):
+        """ (path, signature, content digest, parsed data) for each file the
+        snippets were loaded from, in load order. """
+        return list(self._sources)
+
     def reset(self):
         self._snippets = []
         self._extends = []
-        self._files = {}
-
-
-    def _hash(self, path):
-        if not os.path.isfile(path):
-            return False
-
-        return hashlib.sha1(open(path, "rb").read()).hexdigest()
-
-
-    def addfile(self, path):
-        self.files[path] = self._hash(path)
+        self._files = FileTracker()
+        self._sources = []
+        self._file_order = {}
+        self._by_file = {}
+
+        self._index.clear()
+        for s in self._added:
+            self._index_snippet(s, 0)
+        self._changed()
+
+    def addfile(self, path, content_digest=None, parsed=None, signature=None):
+        self._files.add(path, content_digest, signature)
+        self._file_order.setdefault(path, len(self._file_order))
+        if parsed is not None:
+            source = (path, signature, content_digest, parsed)
+            for idx, other in enumerate(self._sources):
+                if other[0] == path:
+                    self._sources[idx] = source
+                    break
+            else:
+                self._sources.append(source)
 
     def needs_update(self):
-        for path, hash in self.files.items():
-            if not hash or hash != self._hash(path):
-                return True
-        return False
+        return self._files.changed()
 
     def extends():
         def fget(self):
             return self._extends
         def fset(self, value):
             self._extends = value
+            self._changed()
         return locals()
     extends = property(**extends())
 
+    def add_extends(self, ft):
+        if ft not in self._extends:
+            self._extends.append(ft)
+            self._changed()
+
 class _SnippetsFileParser(object):
-    def __init__(self, ft, fn, snip_manager, file_data=None):
-        self._sm = snip_manager
-        self._ft = ft
-        self._fn = fn
+    """
+    Parses a snippet file into plain data that can be cached and later be
+    applied to the SnippetManager via _apply_parsed_snippets.
+
+    The result is a dictionary with the keys 'globals', mapping the trigger
+    of each 'global' block to the list of its contents, and 'directives', a
+    list of ["snippet", trigger, value, descr, options], ["extends", [fts]],
+    ["clearsnippets", [triggers]] and ["error", msg, lineno] entries in the
+    order they appear in the file.
+    """
+    def __init__(self, lines):
         self._globals = {}
-        if file_data is None:
-            self._lines = open(fn).readlines()
-        else:
-            self._lines = file_data.splitlines(True)
+        self._directives = []
+        self._lines = lines
 
         self._idx = 0
 
     def _error(self, msg):
-        fn = _vim.eval("""fnamemodify(%s, ":~:.")""" % _vim.escape(self._fn))
-        self._sm._error("%s in %s(%d)" % (msg, fn, self._idx + 1))
+        self._directives.append(["error", msg, self._idx + 1])
 
     def _line(self):
         if self._idx < len(self._lines):
@@ -212,7 +289,7 @@ class _SnippetsFileParser(object):
                 self._globals[trig] = []
             self._globals[trig].append(cv)
         elif snip == "snippet":
-            self._sm.add_snippet(trig, cv, desc, opts, self._ft, self._globals, fn=self._fn)
+            self._directives.append(["snippet", trig, cv, desc, opts])
         else:
             self._error("Invalid snippet type: '%s'" % snip)
 
@@ -221,19 +298,21 @@ class _SnippetsFileParser(object):
             head, tail = self._line_head_tail()
             if head == "extends":
                 if tail:
-                    self._sm.add_extending_info(self._ft,
-                        [ p.strip() for p in tail.split(',') ])
+                    self._directives.append(["extends",
+                        [ p.strip() for p in tail.split(',') ]])
                 else:
                     self._error("'extends' without file types")
             elif head in ("snippet", "global"):
                 self._parse_snippet()
             elif head == "clearsnippets":
-                self._sm.clear_snippets(tail.split(), self._ft)
+                self._directives.append(["clearsnippets", tail.split()])
             elif head and not head.startswith('#'):
                 self._error("Invalid line %r" % self._line().rstrip())
                 break
             self._goto_next_line()
 
+        return { "globals": self._globals, "directives": self._directives }
+
 
 
 class Snippet(object):
@@ -249,6 +328,14 @@ class Snippet(object):
         self._last_re = None
         self._globals = globals
 
+        self._re = self._re_at_end = None
+        if "r" in self._opts:
+            try:
+                self._re = re.compile(self._t)
+            except re.error:
+                pass # Reported when we try to match.
+            self._re_at_end = regex_at_end(self._t)
+
     def __repr__(self):
         return "Snippet(%s,%s,%s)" % (self._t,self._d,self._opts)
 
@@ -257,28 +344,21 @@ class Snippet(object):
         If num_words is None, then use the number of words in
         the trigger.
         """
-        words = ''
-        if not len(before):
-            return ''
-
         if num_words is None:
             num_words = len(self._t.split())
-
-        word_list = before.split()
-        if len(word_list) <= num_words:
-            return before.strip()
-        else:
-            before_words = before
-            for i in range(-1, -(num_words + 1), -1):
-                left = before_words.rfind(word_list[i])
-                before_words = before_words[:left]
-            return before[len(before_words):].strip()
+        return words_for_line(before, num_words)
 
     def _re_match(self, trigger):
         """ Test if a the current regex trigger matches
         `trigger`. If so, set _last_re and _matched.
         """
-        for match in re.finditer(self._t, trigger):
+        if self._re is None:
+            self._re = re.compile(self._t)
+        # Cheap check if there is any match that ends at the end of trigger.
+        if self._re_at_end is not None and \
+                not self._re_at_end.search(trigger):
+            return False
+        for match in self._re.finditer(trigger):
             if match.end() != len(trigger):
                 continue
             else:
@@ -430,11 +510,11 @@ class VisualContentPreserver(object):
         self._text = as_unicode("")
 
     def conserve(self):
-        sl, sbyte = map(int, (_vim.eval("""line("'<")"""), _vim.eval("""col("'<")""")))
-        el, ebyte = map(int, (_vim.eval("""line("'>")"""), _vim.eval("""col("'>")""")))
+        sl, sbyte, el, ebyte, self._mode = _vim.eval_many(("""line("'<")""",
+            """col("'<")""", """line("'>")""", """col("'>")""", "visualmode()"))
+        sl, sbyte, el, ebyte = map(int, (sl, sbyte, el, ebyte))
         sc = byte2col(sl, sbyte - 1)
         ec = byte2col(el, ebyte - 1)
-        self._mode = _vim.eval("visualmode()")
 
         def _vim_line_with_eol(ln):
             return _vim.buf[ln] + '\n'
@@ -460,8 +540,9 @@ class VisualContentPreserver(object):
 class _VimPosition(Position):
     def __init__(self):
         pos = _vim.buf.cursor
-        self._mode = _vim.eval("mode()")
-        self._visualmode = _vim.eval("visualmode()")
+        self._snapshot = _vim.snapshot()
+        self._mode = self._snapshot.mode
+        self._visualmode = self._snapshot.visualmode
         Position.__init__(self, pos.line, pos.col)
 
     @property
@@ -470,6 +551,10 @@ class _VimPosition(Position):
     @property
     def visualmode(self):
         return self._visualmode
+    @property
+    def snapshot(self):
+        """ The VimSnapshot this position was taken with. """
+        return self._snapshot
 
 
 class VimState(object):
@@ -480,6 +565,7 @@ class VimState(object):
         """
         self._poss = deque(maxlen=5)
         self._lvb = None
+        self._lvb_tick = None
 
     def remember_position(self):
         self._poss.append(_VimPosition())
@@ -488,6 +574,13 @@ class VimState(object):
         self._lvb = _vim.buf[to.start.line:to.end.line+1]
         self._lvb_len = len(_vim.buf)
         self.remember_position()
+        self._lvb_tick = self.pos.snapshot.changedtick
+
+    @property
+    def buffer_changed(self):
+        """ True if the buffer was changed since it was last remembered,
+        judged by b:changedtick at the last remembered position. """
+        return self.pos.snapshot.changedtick != self._lvb_tick
 
     @property
     def diff_in_buffer_length(self):
@@ -504,10 +597,90 @@ class VimState(object):
         return self._lvb[:]
 
 
+def _read_snippet_file(fn, cache, tracker=None):
+    """ Returns (signature, content digest, parsed data) for the snippet file
+    fn. cache is a SnippetFileCache or None. If tracker, a FileTracker,
+    already hashed the file as it is now, that digest is used and the file
+    is not read at all if cache knows it. This does not talk to Vim.
+
+    The file is looked at before it is read. A write in between makes the
+    signature older than the content, so the file is only read once more
+    later instead of never again. """
+    signature = stat_signature(fn)
+    content_digest = tracker.digest_for(fn, signature) if tracker else None
+    raw = None
+    if content_digest is None:
+        raw = _read_file(fn)
+        content_digest = digest(raw)
+
+    parsed = cache.get(fn, content_digest) if cache else None
+    if parsed is None:
+        if raw is None:
+            raw = _read_file(fn)
+            if stat_signature(fn) != signature:
+                # Changed since the tracker hashed it.
+                content_digest = digest(raw)
+        parsed = _SnippetsFileParser(file_lines(raw)).parse()
+        if cache:
+            cache.put(fn, content_digest, parsed)
+    return signature, content_digest, parsed
+
+def _read_file(fn):
+    with open(fn, "rb") as f:
+        return f.read()
+
+def _clears_snippets(parsed):
+    """ Returns True if the parsed snippet file uses clearsnippets. """
+    return any(d[0] == "clearsnippets" for d in parsed["directives"])
+
+def _find_snippet_files(directories, search_dirs, ft, default=True):
+    """ Returns the snippet files for ft in search_dirs, which are (path,
+    shipped) tuples. directories is the DirectoryCache to use. This does not
+    talk to Vim. """
+    ret = []
+    seen = set()
+    for pth, shipped in search_dirs:
+        names = directories.listdir(pth)
+        if names is None:
+            continue
+
+        patterns = ["%s.snippets", "%s_*.snippets"]
+        if not default and shipped:
+            patterns.remove("%s.snippets")
+
+        found = []
+        for pattern in patterns:
+            found.extend(directories.glob(pth, pattern % ft))
+        if ft in names:
+            found.extend(directories.glob(os.path.join(pth, ft), "*"))
+
+        for fn in found:
+            if fn not in seen:
+                seen.add(fn)
+                ret.append(fn)
+
+    return ret
+
 class SnippetManager(object):
+    # The methods plugin/UltiSnips.vim calls through dispatch().
+    ENTRY_POINTS = (
+        "add_buffer_filetypes", "add_snippet", "cursor_moved", "expand",
+        "expand_anon", "expand_or_jump", "jump_backwards", "jump_forwards",
+        "leaving_buffer", "list_snippets", "list_snippets_dict",
+        "option_changed", "reset_buffer_filetypes",
+        "save_last_visual_selection",
+    )
+
     def __init__(self):
         self._supertab_keys = None
         self._csnippets = []
+        self._tracked_buffer = None
+        self._dispatching = False
+        self._return_expr = ""
+        self._entry_points = dict((name, getattr(self, name))
+                for name in self.ENTRY_POINTS)
+        self._cache = None
+        self._cache_settings = None
 
         self.reset()
 
@@ -516,14 +689,39 @@ class SnippetManager(object):
         self._vstate = VimState()
         self._test_error = test_error
         self._snippets = {}
+        self._views = {}
+        self._search_dirs = None
+        self._directories = DirectoryCache()
         self._filetypes = defaultdict(lambda: ['all'])
         self._visual_content = VisualContentPreserver()
+        self._snippet_file_cache()
+
+        if getattr(self, "_watcher", None) is not None:
+            self._watcher.stop()
+        self._watcher = None
+        if _vim.eval("exists('g:UltiSnipsWatchSnippetFiles')") == "1" and \
+                _vim.eval("g:UltiSnipsWatchSnippetFiles") != "0":
+            self._watcher = self._start_watcher()
 
         while len(self._csnippets):
             self._current_snippet_is_done()
 
         self._reinit()
 
+    def dispatch(self, name, args):
+        """ Calls the entry point name with the list of arguments args.
+        Returns the Vim expression the calling Vim function should return or
+        the empty string. """
+        outer = self._dispatching, self._return_expr
+        self._dispatching, self._return_expr = True, ""
+        outer_event = _vim.begin_event(name)
+        try:
+            self._entry_points[name](*args)
+            return self._return_expr
+        finally:
+            _vim.end_event(outer_event)
+            self._dispatching, self._return_expr = outer
+
     @err_to_scratch_buffer
     def jump_forwards(self):
         _vim.command("let g:ulti_jump_forwards_res = 1")
@@ -628,9 +826,10 @@ class SnippetManager(object):
         )
 
     @err_to_scratch_buffer
-    def add_snippet_file(self, ft, path):
+    def add_snippet_file(self, ft, path, content_digest=None, parsed=None,
+            signature=None):
         sd = self.snippet_dict(ft)
-        sd.addfile(path)
+        sd.addfile(path, content_digest, parsed, signature)
 
     @err_to_scratch_buffer
     def expand_anon(self, value, trigger="", descr="", options="", globals=None):
@@ -655,22 +854,21 @@ class SnippetManager(object):
     def add_extending_info(self, ft, parents):
         sd = self.snippet_dict(ft)
         for p in parents:
-            if p in sd.extends:
-                continue
-
-            sd.extends.append(p)
+            sd.add_extends(p)
 
     @err_to_scratch_buffer
     def cursor_moved(self):
         self._vstate.remember_position()
-        if _vim.eval("mode()") not in 'in':
+        if self._vstate.pos.mode not in 'in':
             return
 
         if self._ignore_movements:
             self._ignore_movements = False
             return
 
-        if self._csnippets:
+        # Nothing to replay if the cursor only moved.
+        changed = self._vstate.buffer_changed
+        if self._csnippets and changed:
             cstart = self._csnippets[0].start.line
             cend = self._csnippets[0].end.line + self._vstate.diff_in_buffer_length
             ct = _vim.buf[cstart:cend + 1]
@@ -715,7 +913,7 @@ class SnippetManager(object):
                 pass # Rather do nothing than throwing an error. It will be correct most of the time
 
         self._check_if_still_inside_snippet()
-        if self._csnippets:
+        if self._csnippets and changed:
             self._csnippets[0].update_textobjects()
             self._vstate.remember_buffer(self._csnippets[0])
 
@@ -763,6 +961,21 @@ class SnippetManager(object):
 
     def _current_snippet_is_done(self):
         self._csnippets.pop()
+        self._track_cursor()
+
+    def _track_cursor(self):
+        """ Tells Vim to report cursor movements in the current buffer if and
+        only if a snippet is active. Otherwise moving around does not call
+        into Python at all. """
+        active = bool(self._csnippets)
+        if active == (self._tracked_buffer is not None):
+            return
+        if active:
+            self._tracked_buffer = _vim.buf.nr
+        _vim.command("call UltiSnips_TrackCursor(%i, %i)" % (
+            self._tracked_buffer, active))
+        if not active:
+            self._tracked_buffer = None
 
     def _jump(self, backwards = False):
         jumped = False
@@ -823,9 +1036,27 @@ class SnippetManager(object):
                 break
 
         if feedkey == r"\<Plug>SuperTabForward" or feedkey == r"\<Plug>SuperTabBackward":
-            _vim.command("return SuperTab(%s)" % _vim.escape(mode))
+            self._return("SuperTab(%s)" % _vim.escape(mode))
         elif feedkey:
-            _vim.command("return %s" % _vim.escape(feedkey))
+            self._return(_vim.escape(feedkey))
+
+    def _return(self, expr):
+        """ Makes the Vim function that called us return the value of the
+        Vim expression expr. """
+        if self._dispatching:
+            self._return_expr = expr
+        else:
+            _vim.command("return %s" % expr)
+
+    def _resolved_view(self):
+        """ Returns the resolved snippets for the filetypes of the current
+        buffer, building them again only if something changed. """
+        filetypes = tuple(self._filetypes[_vim.buf.nr])
+        view = self._views.get(filetypes)
+        if view is None or not view.is_valid(self._snippets):
+            view = self._views[filetypes] = ResolvedView(filetypes,
+                    self._snippets)
+        return view
 
     def _snips(self, before, possible):
         """ Returns all the snippets for the given text
@@ -833,26 +1064,11 @@ class SnippetManager(object):
         possible matches.
         """
         self._ensure_all_loaded()
-        filetypes = self._filetypes[_vim.buf.nr][::-1]
+        return self._matching_snips(before, possible)
 
-        found_snippets = []
-        for ft in filetypes:
-            found_snippets += self._find_snippets(ft, before, possible)
-
-        # Search if any of the snippets overwrites the previous
-        # Dictionary allows O(1) access for easy overwrites
-        snippets = {}
-        for s in found_snippets:
-            if (s.trigger not in snippets) or s.overwrites_previous:
-                snippets[s.trigger] = []
-            snippets[s.trigger].append(s)
-
-        # Transform dictionary into flat list of snippets
-        selected_snippets = set([item for sublist in snippets.values() for item in sublist])
-        # Return snippets to their original order
-        snippets = [snip for snip in found_snippets if snip in selected_snippets]
-
-        return snippets
+    def _matching_snips(self, before, possible):
+        """ Like _snips, but expects the snippets to be loaded already. """
+        return self._resolved_view().matching(before, possible)
 
     def _ask_snippets(self, snippets):
         """ Given a list of snippets, ask the user which one they
@@ -878,6 +1094,11 @@ class SnippetManager(object):
         """ Expands the given snippet, and handles everything
         that needs to be done with it.
         """
+        # Filetype plugins and modelines set the indent options from
+        # autocommands, which do not trigger OptionSet. Read them once for
+        # each expansion; later changes are reported.
+        _vim.forget_indent_settings()
+
         # Adjust before, maybe the trigger is not the complete word
         text_before = before
         if snippet.matched:
@@ -907,6 +1128,7 @@ class SnippetManager(object):
 
         self._visual_content.reset()
         self._csnippets.append(si)
+        self._track_cursor()
 
         self._ignore_movements = True
         self._vstate.remember_buffer(self._csnippets[0])
@@ -917,7 +1139,11 @@ class SnippetManager(object):
         before, after = _vim.buf.current_line_splitted
         if not before:
             return False
-        snippets = self._snips(before, False)
+        self._ensure_all_loaded()
+        view = self._resolved_view()
+        if not view.could_expand(before):
+            return False
+        snippets = view.matching(before, False)
 
         if not snippets:
             # No snippet found
@@ -940,8 +1166,91 @@ class SnippetManager(object):
         return self._csnippets[-1]
 
     def _parse_snippets(self, ft, fn, file_data=None):
-        self.add_snippet_file(ft, fn)
-        _SnippetsFileParser(ft, fn, self, file_data).parse()
+        signature, content_digest = None, None
+        if file_data is None:
+            signature, content_digest, parsed = _read_snippet_file(fn,
+                    self._snippet_file_cache(), self.snippet_dict(ft).files)
+        else:
+            parsed = _SnippetsFileParser(file_data.splitlines(True)).parse()
+
+        self.add_snippet_file(ft, fn, content_digest, parsed, signature)
+        self._apply_parsed_snippets(ft, fn, parsed)
+
+    def _set_snippet_files(self, ft, files):
+        """ Makes the snippets from files of ft those in files, a list of
+        (path, signature, content digest, parsed data) in load order.
+
+        If the same files as before are loaded and no clearsnippets is
+        involved, only the snippets of changed files are replaced. Otherwise
+        all files are applied again in order, which is what clearsnippets
+        needs to work on the snippets that came before it.
+        """
+        sd = self.snippet_dict(ft)
+        old = sd.sources
+        if not old or [ f[0] for f in old ] != [ f[0] for f in files ] or \
+                any(_clears_snippets(f[3]) for f in old + files):
+            sd.reset()
+            for fn, signature, content_digest, parsed in files:
+                self.add_snippet_file(ft, fn, content_digest, parsed,
+                        signature)
+                self._apply_parsed_snippets(ft, fn, parsed)
+            return
+
+        for (fn, signature, content_digest, parsed), old_source in \
+                zip(files, old):
+            if content_digest is not None and content_digest == old_source[2]:
+                continue
+            sd.remove_file_snippets(fn)
+            self.add_snippet_file(ft, fn, content_digest, parsed, signature)
+            self._apply_parsed_snippets(ft, fn, parsed)
+
+        # A changed file might have dropped an extends line.
+        extends = []
+        for fn, signature, content_digest, parsed in files:
+            for directive in parsed["directives"]:
+                if directive[0] == "extends":
+                    extends.extend(p for p in directive[1] if p not in extends)
+        if extends != sd.extends:
+            sd.extends = extends
+
+    def _apply_parsed_snippets(self, ft, fn, parsed):
+        """ Adds the snippets and directives of one parsed snippet file. """
+        globals = parsed["globals"]
+        for directive in parsed["directives"]:
+            head, args = directive[0], directive[1:]
+            if head == "snippet":
+                trig, value, descr, options = args
+                self.add_snippet(trig, value, descr, options, ft, globals,
+                        fn=fn)
+            elif head == "extends":
+                self.add_extending_info(ft, args[0])
+            elif head == "clearsnippets":
+                self.clear_snippets(args[0], ft)
+            elif head == "error":
+                msg, lineno = args
+                fn_for_msg = _vim.eval("""fnamemodify(%s, ":~:.")""" %
+                        _vim.escape(fn))
+                self._error("%s in %s(%d)" % (msg, fn_for_msg, lineno))
+
+    def _snippet_file_cache(self):
+        """ Returns the cache for parsed snippet files or None if the user
+        disabled it by setting g:UltiSnipsCacheDir to the empty string.
+        The same cache is returned until one of the settings changes, so that
+        it can keep track of its size.
+        """
+        settings = _vim.eval_many(("exists('g:UltiSnipsCacheDir')",
+            "get(g:, 'UltiSnipsCacheDir', '')",
+            "get(g:, 'UltiSnipsCacheMaxSize', %i)" % (10 * 1024 * 1024)))
+        if settings != self._cache_settings:
+            self._cache_settings = settings
+            exists, cache_dir, max_size = settings
+            if exists == "0":
+                cache_dir = default_cache_dir()
+            elif cache_dir:
+                cache_dir = os.path.expanduser(cache_dir)
+            self._cache = SnippetFileCache(cache_dir, int(max_size)) \
+                    if cache_dir else None
+        return self._cache
 
     def base_snippet_files_for(self, ft, default=True):
         """ Returns a list of snippet files matching the given filetype (ft).
@@ -954,33 +1263,39 @@ class SnippetManager(object):
         the filetype.
         """
 
+        return _find_snippet_files(self._directories,
+                self._snippet_search_dirs(), ft, default)
+
+    def _snippet_search_dirs(self):
+        """ Returns (path, shipped) for each directory that might contain
+        snippet files in search order. shipped is True for the directory
+        with the snippets that come with UltiSnips.
+
+        Resolving the paths is only done again when one of the options
+        involved changes.
+        """
         if _vim.eval("exists('b:UltiSnipsSnippetDirectories')") == "1":
             snippet_dirs = _vim.eval("b:UltiSnipsSnippetDirectories")
         else:
             snippet_dirs = _vim.eval("g:UltiSnipsSnippetDirectories")
-        base_snippets = os.path.realpath(os.path.join(__file__, "../../../UltiSnips"))
-        ret = []
-
-        paths = _vim.eval("&runtimepath").split(',')
+        reverse = _vim.eval("exists('g:UltiSnipsDontReverseSearchPath')") == "0" or \
+           _vim.eval("g:UltiSnipsDontReverseSearchPath") == "0"
+        key = (_vim.option("runtimepath"), tuple(snippet_dirs), reverse)
+        if self._search_dirs is not None and self._search_dirs[0] == key:
+            return self._search_dirs[1]
 
-        if _vim.eval("exists('g:UltiSnipsDontReverseSearchPath')") == "0" or \
-           _vim.eval("g:UltiSnipsDontReverseSearchPath") == "0":
+        base_snippets = os.path.realpath(os.path.join(__file__, "../../../UltiSnips"))
+        paths = key[0].split(',')
+        if reverse:
             paths = paths[::-1]
 
+        rv = []
         for rtp in paths:
             for snippet_dir in snippet_dirs:
                 pth = os.path.realpath(os.path.expanduser(os.path.join(rtp, snippet_dir)))
-
-                patterns = ["%s.snippets", "%s_*.snippets", os.path.join("%s","*")]
-                if not default and pth == base_snippets:
-                    patterns.remove("%s.snippets")
-
-                for pattern in patterns:
-                    for fn in glob.glob(os.path.join(pth, pattern % ft)):
-                        if fn not in ret:
-                            ret.append(fn)
-
-        return ret
+                rv.append((pth, pth == base_snippets))
+        self._search_dirs = (key, rv)
+        return rv
 
     @property
     def primary_filetype(self):
@@ -1028,10 +1343,18 @@ class SnippetManager(object):
 
     # Loading
     def _load_snippets_for(self, ft):
-        self.snippet_dict(ft).reset()
+        sd = self.snippet_dict(ft)
+        changed = sd.files.changed_files()
+        known = dict((f[0], f) for f in sd.sources)
+        cache = self._snippet_file_cache()
 
+        files = []
         for fn in self.base_snippet_files_for(ft):
-            self._parse_snippets(ft, fn)
+            if fn in known and fn not in changed:
+                files.append(known[fn])
+            else:
+                files.append((fn,) + _read_snippet_file(fn, cache, sd.files))
+        self._set_snippet_files(ft, files)
 
         # Now load for the parents
         for p in self._snippets[ft].extends:
@@ -1039,20 +1362,69 @@ class SnippetManager(object):
                 self._load_snippets_for(p)
 
 
+    def _start_watcher(self):
+        """ Starts a SnippetFileWatcher that parses changed snippet files in
+        the background. """
+        cache = self._snippet_file_cache()
+        directories = DirectoryCache()
+
+        def reparse(ft, search_dirs):
+            rv = []
+            for fn in _find_snippet_files(directories, search_dirs, ft):
+                try:
+                    rv.append((fn,) + _read_snippet_file(fn, cache))
+                except (IOError, OSError):
+                    pass # Removed while we were looking.
+            return rv
+
+        interval = 1.0
+        if _vim.eval('exists("g:UltiSnipsFileCheckInterval")') == "1":
+            interval = float(_vim.eval("g:UltiSnipsFileCheckInterval")) or \
+                    interval
+        return SnippetFileWatcher(reparse, interval)
+
+    def _update_watcher(self):
+        """ Tells the watcher about the files of the loaded filetypes. """
+        if self._watcher is None or not self._watcher.alive:
+            return
+        files = []
+        for sd in self._snippets.values():
+            files.extend(sd.files)
+        self._watcher.watch(self._snippet_search_dirs(),
+                list(self._snippets), files)
+
+    def _reload_from(self, ft, reparsed):
+        """ Replaces the snippets from files for ft by those the watcher
+        parsed in the background. """
+        self._set_snippet_files(ft, reparsed)
+        self._update_watcher()
+
     def _needs_update(self, ft):
+        if ft not in self._snippets:
+            return True
+        elif self._watcher is not None and self._watcher.alive:
+            # The watcher tells us about changes.
+            return False
+
         do_hash = _vim.eval('exists("g:UltiSnipsDoHash")') == "0" \
                 or _vim.eval("g:UltiSnipsDoHash") != "0"
+        if not do_hash:
+            return False
 
-        if ft not in self._snippets:
-            return True
-        elif do_hash and self.snippet_dict(ft).needs_update():
+        # Do not look at the disk again if we did so only a moment ago.
+        interval = 0
+        if _vim.eval('exists("g:UltiSnipsFileCheckInterval")') == "1":
+            interval = float(_vim.eval("g:UltiSnipsFileCheckInterval"))
+        if not self.snippet_dict(ft).files.due(interval):
+            return False
+
+        if self.snippet_dict(ft).needs_update():
             return True
-        elif do_hash:
-            cur_snips = set(self.base_snippet_files_for(ft))
-            old_snips = set(self.snippet_dict(ft).files)
 
-            if cur_snips - old_snips:
-                return True
+        cur_snips = set(self.base_snippet_files_for(ft))
+        old_snips = set(self.snippet_dict(ft).files)
+        if cur_snips - old_snips:
+            return True
 
         return False
 
@@ -1067,6 +1439,11 @@ class SnippetManager(object):
 
         if self._needs_update(ft):
             self._load_snippets_for(ft)
+            self._update_watcher()
+        elif self._watcher is not None:
+            reparsed = self._watcher.take(ft)
+            if reparsed is not None:
+                self._reload_from(ft, reparsed)
 
         for parent in self.snippet_dict(ft).extends:
             self._ensure_loaded(parent, checked)
@@ -1076,7 +1453,16 @@ class SnippetManager(object):
         for ft in self._filetypes[_vim.buf.nr]:
             self._ensure_loaded(ft)
 
+    def option_changed(self, name):
+        """ Called by Vim whenever one of the options in
+        _vim.WATCHED_OPTIONS or _vim.INDENT_OPTIONS was set. """
+        _vim.option_changed(name)
+
     def reset_buffer_filetypes(self):
+        # Plugin managers often extend 'runtimepath' in autocommands which
+        # do not trigger OptionSet. A new filetype is a good moment to look
+        # at it again.
+        _vim.option_changed("runtimepath")
         if _vim.buf.nr in self._filetypes:
             del self._filetypes[_vim.buf.nr]
 
@@ -1096,35 +1482,18 @@ class SnippetManager(object):
                 idx += 1
 
         self._ensure_all_loaded()
-
-    def _find_snippets(self, ft, trigger, potentially = False, seen=None):
-        """
-        Find snippets matching trigger
-
-        ft          - file type to search
-        trigger     - trigger to match against
-        potentially - also returns snippets that could potentially match; that
-                      is which triggers start with the current trigger
-        """
-        snips = self._snippets.get(ft,None)
-        if not snips:
-            return []
-
-        if not seen:
-            seen = []
-        seen.append(ft)
-
-        parent_results = []
-
-        for p in snips.extends:
-            if p not in seen:
-                seen.append(p)
-                parent_results += self._find_snippets(p, trigger,
-                        potentially, seen)
-
-        return parent_results + snips.get_matching_snippets(
-            trigger, potentially)
-
+        self._update_watcher()
 
 UltiSnips_Manager = SnippetManager()
 
+def UltiSnips_Call(set_result=False):
+    """ The single entry point of plugin/UltiSnips.vim. It is called from
+    s:Call, which keeps [name, args] in l:call, so the arguments arrive in
+    one round trip. Returns what dispatch returns; if set_result is True, it
+    is also stored in l:rv for Vims without pyeval(). """
+    name, args = _vim.eval("l:call")
+    rv = UltiSnips_Manager.dispatch(name, args)
+    if set_result:
+        _vim.command("let l:rv = '%s'" % rv.replace("'", "''"))
+    return as_vimencoding(rv)
+
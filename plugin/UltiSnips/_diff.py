@@ -1,13 +1,52 @@
 #!/usr/bin/env python
 # encoding: utf-8
 
-from collections import defaultdict
+import re
 import sys
+import time
+from collections import Counter
 
-from UltiSnips import _vim
 from UltiSnips.geometry import Position
 
 def is_complete_edit(initial_line, a, b, cmds):
+    """ Returns True if applying cmds to the lines a gives the lines b. Only
+    the lines the commands touch are copied and edited; the others are
+    compared with b in place. """
+    if cmds and (not a or "\n" in "".join(a) or
+            any(cmd[1] < initial_line for cmd in cmds)):
+        return _is_complete_edit_by_joining(initial_line, a, b, cmds)
+
+    window = _EditWindow(a)
+    for ctype, line, col, char in cmds:
+        line -= initial_line
+        if ctype == "D":
+            if char != '\n':
+                idx = window.touch(line)
+                text = window.lines[idx]
+                window.lines[idx] = text[:col] + text[col+len(char):]
+            elif line + 1 < len(window):
+                idx = window.touch(line)
+                window.touch(line + 1)
+                window.lines[idx] += window.lines.pop(idx + 1)
+            else:
+                idx = window.touch(line)
+                del window.lines[idx]
+                if not len(window):
+                    window.lines.append('')
+        elif ctype == "I":
+            idx = window.touch(line)
+            text = window.lines[idx]
+            text = text[:col] + char + text[col:]
+            if '\n' in char:
+                window.lines[idx:idx+1] = text.split('\n')
+            else:
+                window.lines[idx] = text
+    return window.equals(b)
+
+def _is_complete_edit_by_joining(initial_line, a, b, cmds):
+    """ The straightforward version of is_complete_edit. It is still used for
+    commands before initial_line, which index from the end of a, and for
+    lines that contain newlines. """
     buf = a[:]
     for cmd in cmds:
         ctype, line, col, char = cmd
@@ -26,27 +65,82 @@ def is_complete_edit(initial_line, a, b, cmds):
         buf = '\n'.join(buf).split('\n')
     return len(buf) == len(b) and all(j==k for j,k in zip(buf, b))
 
+class _EditWindow(object):
+    """ The lines a[lo:hi] that were touched by edits, kept as a list of
+    their current content in lines. The rest of a is never copied. """
+    __slots__ = ("a", "lo", "hi", "lines")
+
+    def __init__(self, a):
+        self.a = a
+        self.lo = self.hi = 0
+        self.lines = []
+
+    def __len__(self):
+        return len(self.a) - (self.hi - self.lo) + len(self.lines)
+
+    def touch(self, line):
+        """ Grows the window so that it contains the current line and returns
+        the index of that line in self.lines. """
+        if not 0 <= line < len(self):
+            raise IndexError("line %i is not in the buffer" % line)
+        if not self.lines and self.lo == self.hi:
+            self.lo, self.hi = line, line + 1
+            self.lines = [self.a[line]]
+        elif line < self.lo:
+            self.lines[0:0] = self.a[line:self.lo]
+            self.lo = line
+        elif line >= self.lo + len(self.lines):
+            hi = self.hi + line - self.lo - len(self.lines) + 1
+            self.lines.extend(self.a[self.hi:hi])
+            self.hi = hi
+        return line - self.lo
+
+    def equals(self, b):
+        """ Returns True if the edited lines are b. """
+        if len(self) != len(b):
+            return False
+        end = self.lo + len(self.lines)
+        return (self.lines == b[self.lo:end] and
+                self.a[:self.lo] == b[:self.lo] and
+                self.a[self.hi:] == b[end:])
+
+# How often each heuristic of guess_edit found the edit. "none" counts the
+# times it had to give up, so that a diff was needed.
+guess_counts = {}
+
 def guess_edit(initial_line, lt, ct, vs):
     """
     Try to guess what the user might have done by heuristically looking at cursor movement
     number of changed lines and if they got longer or shorter. This will detect most simple
-    movements like insertion, deletion of a line or carriage return.
+    movements like insertion, deletion of a line or carriage return, but also
+    pasted lines, joined lines, completions and block inserts.
     """
     if not len(lt) and not len(ct): return True, ()
+    if len(lt) and not ct: ct = ['']
+    for name, es in _guesses(initial_line, lt, ct, vs):
+        if es is not None and is_complete_edit(initial_line, lt, ct, es):
+            guess_counts[name] = guess_counts.get(name, 0) + 1
+            return True, es
+    guess_counts["none"] = guess_counts.get("none", 0) + 1
+    return False, None
+
+def _guesses(initial_line, lt, ct, vs):
+    """ Yields the name of each heuristic of guess_edit together with the
+    edit it guesses or None. """
     pos = vs.pos
     ppos = vs.ppos
-    if len(lt) and (not ct or (len(ct) == 1 and not ct[0])):  # All text deleted?
+    if len(lt) and len(ct) == 1 and not ct[0]:  # All text deleted?
         es = []
-        if not ct: ct = ['']
         for i in lt:
             es.append(("D", initial_line, 0, i))
             es.append(("D", initial_line, 0, "\n"))
         es.pop() # Remove final \n because it is not really removed
-        if is_complete_edit(initial_line, lt, ct, es): return True, es
+        yield "delete_all", es
     if ppos.mode == 'v': # Maybe selectmode?
-        sv = list(map(int, _vim.eval("""getpos("'<")"""))); sv = Position(sv[1]-1,sv[2]-1)
-        ev = list(map(int, _vim.eval("""getpos("'>")"""))); ev = Position(ev[1]-1,ev[2]-1)
-        if "exclusive" in _vim.eval("&selection"):
+        snapshot = pos.snapshot
+        sv = Position(*snapshot.visual_start)
+        ev = Position(*snapshot.visual_end)
+        if "exclusive" in snapshot.selection:
             ppos.col -= 1 # We want to be inclusive, sorry.
             ev.col -= 1
         es = []
@@ -54,121 +148,729 @@ def guess_edit(initial_line, lt, ct, vs):
             es.append(("D", sv.line, sv.col, lt[sv.line - initial_line][sv.col:ev.col+1]))
             if sv != pos and sv.line == pos.line:
                 es.append(("I", sv.line, sv.col, ct[sv.line - initial_line][sv.col:pos.col+1]))
-        if is_complete_edit(initial_line, lt, ct, es): return True, es
+        yield "select", es
     if pos.line == ppos.line:
         if len(lt) == len(ct): # Movement only in one line
             llen = len(lt[ppos.line - initial_line])
             clen = len(ct[pos.line - initial_line])
             if ppos < pos and clen > llen: # Likely that only characters have been added
-                es = (
+                yield "insert", (
                     ("I", ppos.line, ppos.col, ct[ppos.line - initial_line][ppos.col:pos.col]),
                 )
-                if is_complete_edit(initial_line, lt, ct, es): return True, es
             if clen < llen:
                 if ppos == pos: # 'x' or DEL or dt or something
-                    es = (
+                    yield "delete", (
                         ("D", pos.line, pos.col, lt[ppos.line - initial_line][ppos.col:ppos.col + (llen - clen)]),
                     )
-                    if is_complete_edit(initial_line, lt, ct, es): return True, es
                 if pos < ppos: # Backspacing or dT dF?
-                    es = (
+                    yield "backspace", (
                         ("D", pos.line, pos.col, lt[pos.line - initial_line][pos.col:pos.col + llen - clen]),
                     )
-                    if is_complete_edit(initial_line, lt, ct, es): return True, es
         elif len(ct) < len(lt): # Maybe some lines were deleted? (dd or so)
             es = []
             for i in range(len(lt)-len(ct)):
                 es.append( ("D", pos.line, 0, lt[pos.line - initial_line + i]))
                 es.append( ("D", pos.line, 0, '\n'))
-            if is_complete_edit(initial_line, lt, ct, es): return True, es
+            yield "delete_lines", es
     else: # Movement in more than one line
         if ppos.line + 1 == pos.line and pos.col == 0: # Carriage return?
-            es = (("I", ppos.line, ppos.col, "\n"),)
-            if is_complete_edit(initial_line, lt, ct, es): return True, es
-    return False, None
+            yield "newline", (("I", ppos.line, ppos.col, "\n"),)
+
+    if len(ct) > len(lt): # o, O, p, P or pasted lines?
+        tried = []
+        for line in (ppos.line + 1, pos.line, ppos.line):
+            if line not in tried:
+                tried.append(line)
+                yield "insert_lines", _guess_inserted_lines(initial_line,
+                        lt, ct, line)
+    if len(ct) < len(lt) and pos.line == ppos.line: # J?
+        yield "join", _guess_join(initial_line, lt, ct, pos)
+    if pos.mode[:1] in ("i", "R") and ppos.mode[:1] in ("i", "R"):
+        # Completion, <C-w>, cw, overwriting or pasting in insert mode?
+        yield "replace_before_cursor", _guess_replace_before(initial_line,
+                lt, ct, pos)
+    if len(ct) == len(lt): # Visual block insert?
+        yield "block_insert", _guess_block_insert(initial_line, lt, ct)
+
+def _offset(lines, initial_line, pos):
+    """ Returns the index of pos in '\n'.join(lines) or None if pos is not
+    inside of lines. """
+    idx = pos.line - initial_line
+    if not 0 <= idx < len(lines) or not 0 <= pos.col <= len(lines[idx]):
+        return None
+    return sum(len(l) + 1 for l in lines[:idx]) + pos.col
+
+def _guess_inserted_lines(initial_line, lt, ct, line):
+    """ Guesses that whole lines were inserted before line. """
+    idx = line - initial_line
+    n = len(ct) - len(lt)
+    if not 0 <= idx <= len(lt) or ct[:idx] != lt[:idx] or \
+            ct[idx + n:] != lt[idx:]:
+        return None
+    new_lines = '\n'.join(ct[idx:idx + n])
+    if idx:
+        # Like diff does it, append them to the line before.
+        return _edit_commands(line - 1, len(lt[idx - 1]), "",
+                '\n' + new_lines)
+    return _edit_commands(line, 0, "", new_lines + '\n')
+
+def _guess_join(initial_line, lt, ct, pos):
+    """ Guesses that the line pos is in was joined with the following ones,
+    replacing line breaks and indentation by spaces. """
+    old, new = '\n'.join(lt), '\n'.join(ct)
+    start = _offset(ct, initial_line, pos)
+    if start is None or old[:start] != new[:start]:
+        return None
+    suffix = _common_suffix(old[start:], new[start:])
+    deleted = old[start:len(old) - suffix]
+    inserted = new[start:len(new) - suffix]
+    if '\n' not in deleted or deleted.strip() or inserted.strip():
+        return None
+    return _edit_commands(pos.line, pos.col, deleted, inserted)
 
-def diff(a, b, sline = 0):
+def _guess_replace_before(initial_line, lt, ct, pos):
+    """ Guesses that text was replaced by the text that now ends at the
+    cursor. """
+    old, new = '\n'.join(lt), '\n'.join(ct)
+    end = _offset(ct, initial_line, pos)
+    if end is None:
+        return None
+    old_end = len(old) - (len(new) - end)
+    if old_end < 0 or old[old_end:] != new[end:]:
+        return None
+    start = _common_prefix(old[:old_end], new[:end])
+    line = initial_line + old.count('\n', 0, start)
+    col = start - old.rfind('\n', 0, start) - 1
+    return _edit_commands(line, col, old[start:old_end], new[start:end])
+
+def _guess_block_insert(initial_line, lt, ct):
+    """ Guesses that the same text was inserted at the same column in each
+    line that changed. """
+    changed = [ idx for idx in range(len(lt)) if lt[idx] != ct[idx] ]
+    if len(changed) < 2:
+        return None
+    first_old, first_new = lt[changed[0]], ct[changed[0]]
+    n = len(first_new) - len(first_old)
+    if n <= 0:
+        return None
+    # The inserted text could start at several columns if it repeats the
+    # text around it.
+    col = _common_prefix(first_old, first_new)
+    while col >= 0:
+        text = first_new[col:col + n]
+        if all(ct[idx] == lt[idx][:col] + text + lt[idx][col:]
+                for idx in changed):
+            return tuple(("I", initial_line + idx, col, text)
+                    for idx in changed)
+        col -= 1
+    return None
+
+# How many seconds diff may take before it gives up looking for matches.
+# None means no limit.
+TIMEOUT = 0.1
+
+# How often diff was called, how often the bit-parallel engine had to take
+# over because time ran out and how often regions had to be deleted and
+# inserted as a whole.
+counts = {"diff": 0, "bit_parallel": 0, "fallback": 0}
+
+# The part of the time Myers' algorithm leaves to the bit-parallel engine
+# in case it runs out, and the part both leave for cleaning up the result.
+_FALLBACK_RESERVE = 0.3
+_CLEANUP_RESERVE = 0.4
+
+# The bit-parallel engine keeps len(a) * len(b) bits when it takes over.
+# Larger regions are deleted and inserted as a whole right away.
+_FALLBACK_CELLS = 1 << 26
+
+# The engine diff uses if it is not told otherwise. See ENGINES.
+ENGINE = "myers"
+
+def diff(a, b, sline = 0, timeout = None, engine = None):
     """
-    Return a list of deletions and insertions that will turn a into b. This is
-    done by traversing an implicit edit graph and searching for the shortest
-    route. The basic idea is as follows:
-
-        - Matching a character is free as long as there was no deletion/insertion
-          before. Then, matching will be seen as delete + insert [1].
-        - Deleting one character has the same cost everywhere. Each additional
-          character costs only have of the first deletion.
-        - Insertion is cheaper the earlier it happes. The first character is more
-          expensive that any later [2].
-
-    [1] This is that world -> aolsa will be "D" world + "I" aolsa instead of
+    Return a list of deletions and insertions that will turn a into b. First
+    the lines a and b have in common are found, then the characters the
+    changed lines have in common, pairing up similar lines if many changed.
+    Both is done with Myers' O(ND) algorithm, which only needs linear space
+    [1]. The result is cleaned up afterwards:
+
+        - Short matches between changes are deleted and inserted again [2].
+        - Deletions and insertions surrounded by matches are moved to the
+          front as far as possible [3].
+        - Where text is deleted and inserted at the same place, the deletion
+          comes first.
+
+    Myers' algorithm may use part of timeout seconds. If it takes longer,
+    the remaining differing regions are given to the bit-parallel engine,
+    which is faster on texts that differ a lot. If the time for that is up,
+    too, the regions that are still left are each deleted and inserted as a
+    whole. This is a correct but coarse result. The rest of the time is kept
+    for cleaning up. TIMEOUT is used if timeout is None.
+
+    engine is the name of the algorithm in ENGINES that finds the matches
+    instead of Myers' algorithm. ENGINE is used if it is None.
+
+    [1] E. Myers: An O(ND) Difference Algorithm and Its Variations, 1986.
+    [2] This is that world -> aolsa will be "D" world + "I" aolsa instead of
         "D" w , "D" rld, "I" a, "I" lsa
-    [2] This is that "hello\n\n" -> "hello\n\n\n" will insert a newline after hello
+    [3] This is that "hello\n\n" -> "hello\n\n\n" will insert a newline after hello
         and not after \n
     """
-    d = defaultdict(list)
-    seen = defaultdict(lambda: sys.maxsize)
-
-    d[0] = [ (0,0,sline, 0, ()) ]
-
-    cost = 0
-    D_COST = len(a)+len(b)
-    I_COST = len(a)+len(b)
-    while True:
-        while len(d[cost]):
-            x, y, line, col, what = d[cost].pop()
-
-            if a[x:] == b[y:]:
-                return what
-
-            if x < len(a) and y < len(b) and a[x] == b[y]:
-                ncol = col + 1
-                nline = line
-                if a[x] == '\n':
-                    ncol = 0
-                    nline +=1
-                lcost = cost + 1
-                if (what and what[-1][0] == "D" and what[-1][1] == line and
-                        what[-1][2] == col and a[x] != '\n'):
-                    # Matching directly after a deletion should be as costly as
-                    # DELETE + INSERT + a bit
-                    lcost = (D_COST + I_COST)*1.5
-                if seen[x+1,y+1] > lcost:
-                    d[lcost].append((x+1,y+1, nline, ncol, what))
-                    seen[x+1,y+1] = lcost
-
-            if y < len(b): # INSERT
-                ncol = col + 1
-                nline = line
-                if b[y] == '\n':
-                    ncol = 0
-                    nline += 1
-                if (what and what[-1][0] == "I" and what[-1][1] == nline and
-                    what[-1][2]+len(what[-1][-1]) == col and b[y] != '\n' and
-                    seen[x,y+1] > cost + (I_COST + ncol) // 2
-                ):
-                    seen[x,y+1] = cost + (I_COST + ncol) // 2
-                    d[cost + (I_COST + ncol) // 2].append(
-                        (x,y+1, line, ncol, what[:-1] + (
-                            ("I", what[-1][1], what[-1][2], what[-1][-1] + b[y]),) )
-                    )
-                elif seen[x,y+1] > cost + I_COST + ncol:
-                    seen[x,y+1] = cost + I_COST + ncol
-                    d[cost + ncol + I_COST].append((x,y+1, nline, ncol,
-                        what + (("I", line, col,b[y]),))
-                    )
-            if x < len(a): # DELETE
-                if (what and what[-1][0] == "D" and what[-1][1] == line and
-                    what[-1][2] == col and a[x] != '\n' and what[-1][-1] != '\n' and
-                    seen[x+1,y] > cost + D_COST // 2
-                ):
-                    seen[x+1,y] = cost + D_COST // 2
-                    d[cost + D_COST // 2].append((x+1,y, line, col, what[:-1] +
-                        (("D",line, col, what[-1][-1] + a[x]),) )
-                    )
-                elif seen[x+1,y] > cost + D_COST:
-                    seen[x+1,y] = cost + D_COST
-                    d[cost + D_COST].append((x+1,y, line, col, what +
-                        (("D",line, col, a[x]),) )
-                    )
-        cost += 1
+    engine = ENGINES[engine or ENGINE]
+    reserve = _FALLBACK_RESERVE if engine is _myers else 0
+    budget = _Budget(TIMEOUT if timeout is None else timeout, reserve)
+    ops = _line_diff(a, b, budget, engine)
+    counts["diff"] += 1
+    if budget.took_over:
+        counts["bit_parallel"] += 1
+    if budget.coarse:
+        counts["fallback"] += 1
+    ops = _cleanup_semantic(ops)
+    ops = _shift_left(ops)
+    return _to_commands(ops, sline)
+
+# Helper functions  {{{
+class _Budget(object):
+    """ The time a diff may still take. The engine that uses it has to stop
+    when reserve of it is left, so that the engine that takes over gets the
+    rest. coarse is True once a region was deleted and inserted as a whole
+    because the time was up. """
+    def __init__(self, timeout, reserve = 0, parent = None):
+        if parent is not None:
+            self._end = self._deadline = parent._end
+        elif timeout is None:
+            self._end = self._deadline = None
+        else:
+            self._end = time.time() + (1 - _CLEANUP_RESERVE) * timeout
+            self._deadline = self._end - reserve * timeout
+        self._parent = parent
+        self._fallback = None
+        self.exceeded = False
+        self.coarse = False
+
+    @property
+    def took_over(self):
+        """ True if another engine got a budget of its own from fallback. """
+        return self._fallback is not None
+
+    def fallback(self):
+        """ Returns the budget of the engine that takes over once this one is
+        exceeded, which is the time that was reserved for it. It is the same
+        for all regions that are left. """
+        if self._fallback is None:
+            self._fallback = _Budget(None, parent = self)
+        return self._fallback
+
+    def give_up(self, a, b):
+        """ Returns the coarse edit script that deletes a and inserts b. """
+        budget = self
+        while budget is not None:
+            budget.coarse = True
+            budget = budget._parent
+        return [("-", a), ("+", b)]
+
+    def spent(self):
+        """ Returns True once the time of the engine that takes over is up,
+        too. """
+        return self._end is not None and time.time() >= self._end
+
+    def left(self):
+        """ Returns False once the time is up. """
+        if self._deadline is not None and not self.exceeded and \
+                time.time() >= self._deadline:
+            self.exceeded = True
+        return not self.exceeded
+
+# The edit scripts below are lists of (op, text) tuples. op is "=" for text
+# in a and b, "-" for text only in a and "+" for text only in b.
+_NEWLINES = re.compile(r'(\n)')
+
+def _common_prefix(a, b):
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+def _common_suffix(a, b):
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[-1 - i] == b[-1 - i]:
+        i += 1
+    return i
+
+try:
+    _unichr = unichr
+except NameError: # Py3
+    _unichr = chr
+
+def _split_lines(text):
+    """ Splits text into lines, keeping the newlines. """
+    rv = [ line + "\n" for line in text.split("\n") ]
+    rv[-1] = rv[-1][:-1]
+    if not rv[-1]:
+        rv.pop()
+    return rv
+
+def _lines_to_chars(a, b):
+    """ Encodes each distinct line of a and b as one character. Returns the
+    encoded a and b and the list of lines indexed by character. Returns None
+    if there are more distinct lines than characters. """
+    lines = []
+    codes = {}
+    encoded = []
+    for text in (a, b):
+        chars = []
+        for line in _split_lines(text):
+            code = codes.get(line)
+            if code is None:
+                if len(lines) > sys.maxunicode:
+                    return None
+                code = codes[line] = _unichr(len(lines))
+                lines.append(line)
+            chars.append(code)
+        encoded.append("".join(chars))
+    return encoded[0], encoded[1], lines
+
+def _line_diff(a, b, budget, engine):
+    """ Returns an edit script that turns a into b. Unchanged lines are found
+    first, so the character diff only needs to look at the changed ones. """
+    if "\n" not in a and "\n" not in b:
+        return engine(a, b, budget)
+    encoded = _lines_to_chars(a, b)
+    if encoded is None:
+        return engine(a, b, budget)
+    chars_a, chars_b, lines = encoded
+
+    rv = []
+    deleted, inserted = [], []
+    for op, chars in _merge(engine(chars_a, chars_b, budget)):
+        text = [ lines[ord(c)] for c in chars ]
+        if op == "-":
+            deleted += text
+        elif op == "+":
+            inserted += text
+        else:
+            rv.extend(_hunk_diff(deleted, inserted, budget, engine))
+            deleted, inserted = [], []
+            rv.append(("=", "".join(text)))
+    rv.extend(_hunk_diff(deleted, inserted, budget, engine))
+    return rv
+
+# Runs of changed lines with more characters than this are diffed line by
+# line. Shorter ones are diffed as a whole, which finds the best edit even if
+# lines were joined or split.
+_HUNK_SIZE = 200
+
+def _hunk_diff(deleted, inserted, budget, engine):
+    """ Returns an edit script that turns the lines deleted into the lines
+    inserted. If they are longer than _HUNK_SIZE, each deleted line is
+    paired with an inserted line that looks like it, and each pair is diffed
+    on its own, so that the time this takes grows with the number of lines
+    and not with the square of their total length. The lines between the
+    pairs are diffed as a whole. Once the time is spent, the rest is
+    deleted and inserted as a whole. """
+    if not deleted or not inserted:
+        return engine("".join(deleted), "".join(inserted), budget)
+    if sum(len(l) for l in deleted) + sum(len(l) for l in inserted) <= \
+            _HUNK_SIZE:
+        return engine("".join(deleted), "".join(inserted), budget)
+    rv = []
+    start_d = start_i = 0
+    for idx_d, idx_i in _pair_lines(deleted, inserted):
+        if budget.spent():
+            break
+        rv.extend(engine("".join(deleted[start_d:idx_d]),
+            "".join(inserted[start_i:idx_i]), budget))
+        rv.extend(engine(deleted[idx_d], inserted[idx_i], budget))
+        start_d, start_i = idx_d + 1, idx_i + 1
+    rest_d, rest_i = "".join(deleted[start_d:]), "".join(inserted[start_i:])
+    if budget.spent():
+        rv.extend(budget.give_up(rest_d, rest_i))
+    else:
+        rv.extend(engine(rest_d, rest_i, budget))
+    return rv
+
+# How many lines _pair_lines looks ahead for a line that is more similar.
+_LOOKAHEAD = 8
+
+def _pair_lines(deleted, inserted):
+    """ Yields the indices of deleted and inserted lines that were probably
+    edited into each other, in order. If there are as many deleted as
+    inserted lines left, they are paired one by one. Otherwise lines are
+    skipped if one of the next lines has more characters in common with the
+    line it would be paired with. """
+    chars_d = [None] * len(deleted)
+    chars_i = [None] * len(inserted)
+    def _common(idx_d, idx_i):
+        if chars_d[idx_d] is None:
+            chars_d[idx_d] = Counter(deleted[idx_d])
+        if chars_i[idx_i] is None:
+            chars_i[idx_i] = Counter(inserted[idx_i])
+        return sum((chars_d[idx_d] & chars_i[idx_i]).values())
+
+    idx_d = idx_i = 0
+    while idx_d < len(deleted) and idx_i < len(inserted):
+        if len(deleted) - idx_d == len(inserted) - idx_i:
+            # The lines that are left pair up one by one.
+            for idx in range(len(deleted) - idx_d):
+                yield idx_d + idx, idx_i + idx
+            return
+        common = _common(idx_d, idx_i)
+        for k in range(1, _LOOKAHEAD + 1):
+            if idx_d + k < len(deleted) and \
+                    _common(idx_d + k, idx_i) > common:
+                idx_d += k
+                break
+            if idx_i + k < len(inserted) and \
+                    _common(idx_d, idx_i + k) > common:
+                idx_i += k
+                break
+        yield idx_d, idx_i
+        idx_d += 1
+        idx_i += 1
+
+def _with_common_ends(middle, a, b, budget):
+    """ Returns an edit script that turns a into b. Only the part between the
+    common prefix and suffix is given to middle. """
+    if a == b:
+        return [("=", a)] if a else []
+
+    prefix = _common_prefix(a, b)
+    suffix = _common_suffix(a[prefix:], b[prefix:])
+    rv = []
+    if prefix:
+        rv.append(("=", a[:prefix]))
+    rv.extend(middle(a[prefix:len(a) - suffix], b[prefix:len(b) - suffix],
+        budget))
+    if suffix:
+        rv.append(("=", a[len(a) - suffix:]))
+    return rv
+
+def _myers(a, b, budget):
+    """ Returns the shortest edit script that turns a into b. """
+    return _with_common_ends(_myers_middle, a, b, budget)
+
+def _myers_middle(a, b, budget):
+    """ Like _myers, but a and b have no common prefix or suffix. """
+    if not a:
+        return [("+", b)] if b else []
+    if not b:
+        return [("-", a)]
+
+    longer, shorter = (a, b) if len(a) > len(b) else (b, a)
+    idx = longer.find(shorter)
+    if idx != -1:
+        # The shorter text is part of the longer one.
+        op = "-" if longer is a else "+"
+        return [(op, longer[:idx]), ("=", shorter),
+                (op, longer[idx + len(shorter):])]
+    if set(shorter).isdisjoint(longer):
+        # Nothing matches, which happens for instance at the line level when
+        # each line changed.
+        return [("-", a), ("+", b)]
+    return _bisect(a, b, budget)
+
+def _bisect(a, b, budget):
+    """ Finds the middle snake of the shortest edit script by searching
+    forwards from the start and backwards from the end at the same time,
+    then solves both halves on their own. Only keeps two arrays of
+    len(a) + len(b) entries. """
+    la, lb = len(a), len(b)
+    max_d = (la + lb + 1) // 2
+    v_offset = max_d
+    v_length = 2 * max_d
+    v1 = [-1] * v_length
+    v2 = [-1] * v_length
+    v1[v_offset + 1] = 0
+    v2[v_offset + 1] = 0
+    delta = la - lb
+    # If the total number of characters is odd, the front path collides
+    # with the reverse path.
+    front = (delta % 2 != 0)
+    # Offsets for the start and end of the k loops. They prevent mapping of
+    # space beyond the grid.
+    k1start = k1end = k2start = k2end = 0
+    for d in range(max_d):
+        if not budget.left():
+            break
+        for k1 in range(-d + k1start, d + 1 - k1end, 2):
+            k1_offset = v_offset + k1
+            if k1 == -d or (k1 != d and
+                    v1[k1_offset - 1] < v1[k1_offset + 1]):
+                x1 = v1[k1_offset + 1]
+            else:
+                x1 = v1[k1_offset - 1] + 1
+            y1 = x1 - k1
+            while x1 < la and y1 < lb and a[x1] == b[y1]:
+                x1 += 1
+                y1 += 1
+            v1[k1_offset] = x1
+            if x1 > la:
+                k1end += 2 # Ran off the right of the grid
+            elif y1 > lb:
+                k1start += 2 # Ran off the bottom of the grid
+            elif front:
+                k2_offset = v_offset + delta - k1
+                if 0 <= k2_offset < v_length and v2[k2_offset] != -1:
+                    # Mirror x2 onto the top left coordinate system.
+                    if x1 >= la - v2[k2_offset]:
+                        return _bisect_split(a, b, x1, y1, budget)
+
+        for k2 in range(-d + k2start, d + 1 - k2end, 2):
+            k2_offset = v_offset + k2
+            if k2 == -d or (k2 != d and
+                    v2[k2_offset - 1] < v2[k2_offset + 1]):
+                x2 = v2[k2_offset + 1]
+            else:
+                x2 = v2[k2_offset - 1] + 1
+            y2 = x2 - k2
+            while x2 < la and y2 < lb and a[la - x2 - 1] == b[lb - y2 - 1]:
+                x2 += 1
+                y2 += 1
+            v2[k2_offset] = x2
+            if x2 > la:
+                k2end += 2 # Ran off the left of the grid
+            elif y2 > lb:
+                k2start += 2 # Ran off the top of the grid
+            elif not front:
+                k1_offset = v_offset + delta - k2
+                if 0 <= k1_offset < v_length and v1[k1_offset] != -1:
+                    x1 = v1[k1_offset]
+                    y1 = v_offset + x1 - k1_offset
+                    # Mirror x2 onto the top left coordinate system.
+                    if x1 >= la - x2:
+                        return _bisect_split(a, b, x1, y1, budget)
+
+    if budget.exceeded:
+        return _after_timeout(a, b, budget)
+    # The number of edits equals the number of characters, which means that
+    # nothing matches.
+    return [("-", a), ("+", b)]
+
+def _after_timeout(a, b, budget):
+    """ Lets the bit-parallel engine find the edit script that turns a into b
+    once Myers' algorithm ran out of time. """
+    if len(a) * len(b) > _FALLBACK_CELLS:
+        return budget.give_up(a, b)
+    return _bit_parallel(a, b, budget.fallback())
+
+def _bisect_split(a, b, x, y, budget):
+    return _myers(a[:x], b[:y], budget) + _myers(a[x:], b[y:], budget)
+
+def _bit_parallel(a, b, budget):
+    """ Returns the shortest edit script that turns a into b, found through
+    their longest common subsequence. """
+    return _with_common_ends(_bit_parallel_middle, a, b, budget)
+
+def _bit_parallel_middle(a, b, budget):
+    """ Computes the rows of the LCS table with the bit-vector algorithm of
+    Crochemore et al. [1] and Hyyroe [2]. Python integers are the bit
+    vectors, so one row costs a few operations on len(a) bit numbers. Bit i
+    of row j is 0 exactly if LCS(a[:i+1], b[:j]) is one longer than
+    LCS(a[:i], b[:j]), which is enough to walk back through the table.
+
+    [1] M. Crochemore et al.: A Fast and Practical Bit-Vector Algorithm for
+        the Longest Common Subsequence Problem, 2001.
+    [2] H. Hyyroe: Bit-Parallel LCS-length Computation Revisited, 2004.
+    """
+    if not a:
+        return [("+", b)] if b else []
+    if not b:
+        return [("-", a)]
+
+    matches = {}
+    for i, c in enumerate(a):
+        matches[c] = matches.get(c, 0) | (1 << i)
+    mask = (1 << len(a)) - 1
+    v = mask
+    rows = [v]
+    for c in b:
+        if not budget.left():
+            return budget.give_up(a, b)
+        u = v & matches.get(c, 0)
+        v = ((v + u) | (v - u)) & mask
+        rows.append(v)
+
+    rv = []
+    i, j = len(a), len(b)
+    while i and j:
+        if a[i - 1] == b[j - 1]:
+            rv.append(("=", a[i - 1]))
+            i -= 1
+            j -= 1
+        elif (rows[j] >> (i - 1)) & 1:
+            rv.append(("-", a[i - 1]))
+            i -= 1
+        else:
+            rv.append(("+", b[j - 1]))
+            j -= 1
+    if i:
+        rv.append(("-", a[:i]))
+    if j:
+        rv.append(("+", b[:j]))
+    rv.reverse()
+    return _merge(rv)
+
+# The algorithms diff can find matches with. Each is called with a, b and a
+# _Budget and returns an edit script that turns a into b.
+ENGINES = {
+    "myers": _myers,
+    "bit_parallel": _bit_parallel,
+}
+
+def _merge(ops):
+    """ Joins neighbouring operations of the same kind, puts deletions before
+    insertions and turns text that a deletion and the following insertion
+    start or end with into matches. """
+    rv = []
+    deleted, inserted = "", ""
+    def _flush(equal):
+        if deleted and inserted:
+            n = _common_prefix(deleted, inserted)
+            if n:
+                _append(("=", inserted[:n]))
+            m = _common_suffix(deleted[n:], inserted[n:])
+            if deleted[n:len(deleted) - m]:
+                _append(("-", deleted[n:len(deleted) - m]))
+            if inserted[n:len(inserted) - m]:
+                _append(("+", inserted[n:len(inserted) - m]))
+            equal = inserted[len(inserted) - m:] + equal
+        elif deleted:
+            _append(("-", deleted))
+        elif inserted:
+            _append(("+", inserted))
+        if equal:
+            _append(("=", equal))
+    def _append(op):
+        if rv and rv[-1][0] == op[0]:
+            rv[-1] = (op[0], rv[-1][1] + op[1])
+        else:
+            rv.append(op)
+
+    for op, text in ops:
+        if op == "-":
+            deleted += text
+        elif op == "+":
+            inserted += text
+        else:
+            _flush(text)
+            deleted, inserted = "", ""
+    _flush("")
+    return rv
+
+def _cleanup_semantic(ops):
+    """ Deletes and inserts again each match that directly follows a
+    deletion and is not longer than the changes on both sides of it. """
+    ops = _merge(ops)
+    changes = False
+    equalities = [] # Indices of the matches we have seen
+    last_equality = None
+    # Number of characters changed before and after the last match
+    ins_before = del_before = ins_after = del_after = 0
+    pointer = 0
+    while pointer < len(ops):
+        op, text = ops[pointer]
+        if op == "=":
+            equalities.append(pointer)
+            ins_before, del_before = ins_after, del_after
+            ins_after = del_after = 0
+            last_equality = text
+        else:
+            if op == "+":
+                ins_after += len(text)
+            else:
+                del_after += len(text)
+            if last_equality is not None and not ins_before and \
+                    len(last_equality) <= del_before and \
+                    len(last_equality) <= max(ins_after, del_after):
+                idx = equalities.pop()
+                ops[idx:idx + 1] = [("-", last_equality),
+                        ("+", last_equality)]
+                # The match before might be short enough now, too.
+                if equalities:
+                    equalities.pop()
+                pointer = equalities[-1] if equalities else -1
+                ins_before = del_before = ins_after = del_after = 0
+                last_equality = None
+                changes = True
+        pointer += 1
+    return _merge(ops) if changes else ops
+
+def _shift_left(ops):
+    """ Moves each deletion or insertion that is surrounded by matches to the
+    front as far as the text allows it. Once an edit starts with a newline,
+    it only moves over empty lines: it is done at the end of the line before
+    instead of moving into its text, which might belong to another text
+    object than the one the user is typing in. """
+    ops = list(ops)
+    changes = False
+    for i in range(1, len(ops)):
+        op, text = ops[i]
+        if op == "=" or ops[i - 1][0] != "=" or \
+                (i + 1 < len(ops) and ops[i + 1][0] != "="):
+            continue
+        before = ops[i - 1][1]
+        start = text[0]
+        n = 0
+        while n < len(before) and \
+                before[-1 - n] == text[-1 - (n % len(text))] and \
+                (start != "\n" or before[-1 - n] == "\n"):
+            n += 1
+            start = before[-n]
+        if not n:
+            continue
+        moved = before[len(before) - n:] + text
+        ops[i - 1] = ("=", before[:len(before) - n])
+        ops[i] = (op, moved[:len(text)])
+        if i + 1 < len(ops):
+            ops[i + 1] = ("=", moved[len(text):] + ops[i + 1][1])
+        else:
+            ops.append(("=", moved[len(text):]))
+        changes = True
+    if not changes:
+        return ops
+    return _merge([ (op, text) for op, text in ops if text ])
+
+def _to_commands(ops, sline):
+    """ Turns an edit script into the commands diff returns. Newlines are
+    always deleted or inserted on their own. """
+    rv = []
+    line, col = sline, 0
+    for op, text in ops:
+        if op == "=":
+            nl = text.count("\n")
+            if nl:
+                line += nl
+                col = len(text) - text.rfind("\n") - 1
+            else:
+                col += len(text)
+        else:
+            line, col = _append_commands(rv, op, text, line, col)
+    return tuple(rv)
+
+def _append_commands(rv, op, text, line, col):
+    """ Appends the commands that delete (op is "-") or insert (op is "+")
+    text at line, col to rv. Returns the position after the change. """
+    for part in _NEWLINES.split(text):
+        if not part:
+            continue
+        if op == "-":
+            rv.append(("D", line, col, part))
+        else:
+            rv.append(("I", line, col, part))
+            if part == "\n":
+                line += 1
+                col = 0
+            else:
+                col += len(part)
+    return line, col
 
+def _edit_commands(line, col, deleted, inserted):
+    """ Returns the commands that replace deleted by inserted at line, col
+    in the same form as diff returns them. """
+    rv = []
+    _append_commands(rv, "-", deleted, line, col)
+    _append_commands(rv, "+", inserted, line, col)
+    return tuple(rv)
+# End: Helper functions  }}}
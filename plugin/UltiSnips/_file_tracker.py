@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Keeps track of snippet files on disk and tells cheaply if they changed.
+"""
+
+import fnmatch
+import hashlib
+import os
+import time
+
+__all__ = ["DirectoryCache", "FileTracker", "digest", "stat_signature"]
+
+# Modifications that happen in the same clock tick as the one we looked at
+# do not change the mtime. Directories modified less than this many seconds
+# ago are therefore listed again every time.
+_RACY_INTERVAL = 2
+
+def _signature(st):
+    mtime = getattr(st, "st_mtime_ns", None)
+    if mtime is None: # Python < 3.3
+        mtime = int(st.st_mtime * 1e9)
+    return (mtime, st.st_size, st.st_ino)
+
+def stat_signature(path):
+    """Returns a tuple that changes whenever the file at path is modified. If
+    the file does not exist, None is returned."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return _signature(st)
+
+def digest(data):
+    """Returns the fingerprint we use for the content of a file."""
+    return hashlib.sha1(data).hexdigest()
+
+def _hash(path):
+    if not os.path.isfile(path):
+        return False
+    with open(path, "rb") as f:
+        return digest(f.read())
+
+class FileTracker(object):
+    """
+    Remembers the state of a set of files. The content of a file is only
+    hashed again when its (mtime, size, inode) signature has changed, so
+    checking an unchanged file costs one stat call.
+    """
+    def __init__(self):
+        self._files = {}
+        self._last_check = None
+
+    def __contains__(self, path):
+        return path in self._files
+
+    def __iter__(self):
+        return iter(self._files)
+
+    def __len__(self):
+        return len(self._files)
+
+    def add(self, path, content_digest=None, signature=None):
+        """Start tracking path. If content_digest is given, it is taken as the
+        hash of the content of the file instead of reading it again. It must
+        have been read after signature was taken; if signature is None, the
+        file is looked at now."""
+        sig = signature
+        if sig is None:
+            sig = stat_signature(path)
+        if content_digest is None:
+            content_digest = _hash(path) if sig is not None else False
+        # The signature and digest that _check saw last come after these two.
+        self._files[path] = [sig, content_digest, None, None]
+
+    def digest_for(self, path, signature):
+        """Returns the digest we know for path when it has the given signature
+        or None if we never hashed it with that signature."""
+        entry = self._files.get(path)
+        if entry is None or signature is None:
+            return None
+        if entry[0] == signature:
+            return entry[1] or None
+        if entry[2] == signature:
+            return entry[3] or None
+        return None
+
+    def clear(self):
+        self._files = {}
+        self._last_check = None
+
+    def due(self, min_interval):
+        """Returns True if the last check was at least min_interval seconds
+        ago. This allows bursts of checks to cost no system calls at all."""
+        now = time.time()
+        if (min_interval > 0 and self._last_check is not None and
+                0 <= now - self._last_check < min_interval):
+            return False
+        self._last_check = now
+        return True
+
+    def changed(self):
+        """Returns True if any of the tracked files was changed or removed."""
+        for path, entry in self._files.items():
+            if self._check(path, entry):
+                return True
+        return False
+
+    def changed_files(self):
+        """Returns the set of tracked files that were changed or removed."""
+        return set(path for path, entry in self._files.items()
+                if self._check(path, entry))
+
+    @staticmethod
+    def _check(path, entry):
+        old_sig, old_digest = entry[:2]
+        if not old_digest:
+            return True
+        sig = stat_signature(path)
+        if sig == old_sig:
+            return False
+        if sig == entry[2]:
+            new_digest = entry[3]
+        else:
+            new_digest = _hash(path) if sig is not None else False
+            # Until the file is loaded again, every check and the loading
+            # itself would hash it again otherwise.
+            entry[2:] = [sig, new_digest]
+        if new_digest != old_digest:
+            return True
+        # Touched, but the content is unchanged. Remember the new
+        # signature so that we do not hash it again next time.
+        entry[0] = sig
+        return False
+
+class DirectoryCache(object):
+    """
+    Remembers the content of directories. A directory is only listed again
+    when its (mtime, size, inode) signature has changed, so looking into an
+    unchanged directory costs one stat call.
+    """
+    def __init__(self):
+        self._dirs = {}
+
+    def listdir(self, path):
+        """Returns the names in the directory at path in the order
+        os.listdir gives them, or None if path is not a directory."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            self._dirs.pop(path, None)
+            return None
+        sig = _signature(st)
+        entry = self._dirs.get(path)
+        if entry is not None and entry[0] == sig:
+            return entry[1]
+
+        try:
+            names = os.listdir(path)
+        except OSError:
+            self._dirs.pop(path, None)
+            return None
+        if 0 <= time.time() - st.st_mtime < _RACY_INTERVAL:
+            self._dirs.pop(path, None)
+        else:
+            self._dirs[path] = (sig, names)
+        return names
+
+    def glob(self, path, pattern):
+        """Like glob.glob(os.path.join(path, pattern)) for a pattern without
+        directory separators."""
+        names = self.listdir(path)
+        if names is None:
+            return []
+        if not any(c in pattern for c in "*?["):
+            if pattern in names:
+                return [os.path.join(path, pattern)]
+            return []
+        if not pattern.startswith("."):
+            names = [ n for n in names if not n.startswith(".") ]
+        return [ os.path.join(path, n) for n in fnmatch.filter(names, pattern) ]
+
+    def clear(self):
+        self._dirs = {}
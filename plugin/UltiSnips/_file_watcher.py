@@ -0,0 +1,364 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Watches the directories that contain snippet files in a background thread
+and parses changed files there, so that reloading snippets never makes the
+user wait on the disk.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import threading
+
+from UltiSnips._file_tracker import stat_signature
+
+__all__ = ["SnippetFileWatcher"]
+
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ONLYDIR = 0x01000000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+
+_WATCH_MASK = (_IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO |
+        _IN_CREATE | _IN_DELETE | _IN_DELETE_SELF | _IN_MOVE_SELF | _IN_ONLYDIR)
+_EVENT = struct.Struct("iIII")
+
+# How long the thread waits for inotify events before it looks if it should
+# stop or watch other directories.
+_WAKEUP_INTERVAL = 0.5
+# Editors often touch a file several times while saving it. Events that come
+# in this shortly after each other are handled together.
+_SETTLE_TIME = 0.05
+
+def _fsencode(path):
+    if isinstance(path, bytes):
+        return path
+    return path.encode(sys.getfilesystemencoding())
+
+class _Inotify(object):
+    """
+    A minimal binding to the inotify API of Linux. Events are reported as
+    (directory, name) tuples. name is None if the event concerns the
+    directory itself, (None, None) means that events were lost.
+
+    Directories that can not be watched, for example because the limit of
+    watches is reached, and snippet files that are symlinks, whose targets
+    are not watched through their directory, are polled by a _StatPoller.
+    """
+    def __init__(self):
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on Linux")
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6",
+                use_errno=True)
+        self._fd = self._libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._wake_r, self._wake_w = os.pipe()
+        # The main thread wakes us up while our thread might close the file
+        # descriptors. Once closed, their numbers can belong to other files.
+        self._fd_lock = threading.Lock()
+        self._wds = {}
+        self._paths = {}
+        self._poller = _StatPoller()
+
+    def watch(self, directories, files):
+        for path in list(self._wds):
+            if path not in directories:
+                wd = self._wds.pop(path)
+                self._paths.pop(wd, None)
+                self._libc.inotify_rm_watch(self._fd, wd)
+        for path in directories:
+            if path in self._wds:
+                continue
+            wd = self._libc.inotify_add_watch(self._fd, _fsencode(path),
+                    _WATCH_MASK)
+            if wd >= 0:
+                self._wds[path] = wd
+                self._paths[wd] = path
+
+        unwatched = [ path for path in directories if path not in self._wds ]
+        self._poller.watch(unwatched, [ path for path in files if
+            os.path.islink(path) or os.path.dirname(path) in unwatched ])
+
+    def wake(self):
+        """ Makes a waiting read return early. Does nothing once closed. """
+        with self._fd_lock:
+            if self._wake_w is None:
+                return
+            try:
+                os.write(self._wake_w, b"x")
+            except OSError:
+                pass # The next timeout wakes us up anyway.
+
+    def read(self, timeout):
+        return self._read_events(timeout) + self._poller.changes()
+
+    def _read_events(self, timeout):
+        readable = select.select([self._fd, self._wake_r], [], [], timeout)[0]
+        if self._wake_r in readable:
+            os.read(self._wake_r, 4096)
+        if self._fd not in readable:
+            return []
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                return []
+            raise
+
+        rv = []
+        pos = 0
+        while pos + _EVENT.size <= len(data):
+            wd, mask, cookie, length = _EVENT.unpack_from(data, pos)
+            pos += _EVENT.size
+            name = data[pos:pos + length].rstrip(b"\0")
+            pos += length
+            if mask & _IN_Q_OVERFLOW:
+                rv.append((None, None))
+                continue
+            path = self._paths.get(wd)
+            if path is None:
+                continue
+            if mask & _IN_IGNORED:
+                # The directory is gone; we are told about it by
+                # IN_DELETE_SELF or IN_MOVE_SELF.
+                self._paths.pop(wd, None)
+                self._wds.pop(path, None)
+                continue
+            if not name:
+                name = None
+            elif not isinstance(path, bytes):
+                name = name.decode(sys.getfilesystemencoding(), "replace")
+            rv.append((path, name))
+        return rv
+
+    def close(self):
+        with self._fd_lock:
+            if self._fd is None:
+                return
+            for fd in (self._fd, self._wake_r, self._wake_w):
+                os.close(fd)
+            self._fd = self._wake_r = self._wake_w = None
+
+class _StatPoller(object):
+    """
+    Finds the same events as _Inotify by comparing directory listings and
+    the stat signatures of the snippet files after each timeout.
+    """
+    def __init__(self):
+        self._wakeup = threading.Event()
+        self._dirs = {}
+        self._files = {}
+
+    def watch(self, directories, files):
+        self._dirs = dict((path, self._dirs.get(path) or self._look(path))
+                for path in directories)
+        self._files = dict((path, self._files.get(path, stat_signature(path)))
+                for path in files)
+
+    @staticmethod
+    def _look(path):
+        sig = stat_signature(path)
+        try:
+            names = frozenset(os.listdir(path))
+        except OSError:
+            names = frozenset()
+        return sig, names
+
+    def wake(self):
+        self._wakeup.set()
+
+    def read(self, timeout):
+        self._wakeup.wait(timeout)
+        self._wakeup.clear()
+        return self.changes()
+
+    def changes(self):
+        """ Returns the events since the last call without waiting. """
+        rv = []
+        for path, (old_sig, old_names) in list(self._dirs.items()):
+            if stat_signature(path) == old_sig:
+                continue
+            self._dirs[path] = sig, names = self._look(path)
+            if sig is None or old_sig is None:
+                rv.append((path, None))
+            rv.extend((path, name) for name in names ^ old_names)
+        for path, old_sig in list(self._files.items()):
+            sig = stat_signature(path)
+            if sig != old_sig:
+                self._files[path] = sig
+                rv.append(os.path.split(path))
+        return rv
+
+    def close(self):
+        pass
+
+class SnippetFileWatcher(object):
+    """
+    Runs a daemon thread that waits for changes to the snippet files of the
+    loaded filetypes. It uses inotify where available and polls every
+    poll_interval seconds otherwise. When the files of a filetype change,
+    they are parsed again in the thread by calling reparse(ft, search_dirs),
+    which must not talk to Vim. The main thread picks the result up with
+    take(ft) and is responsible for putting it to use.
+
+    If inotify fails while watching, the thread goes on polling. If that
+    fails too, the thread stops and alive becomes False; the caller must
+    then look for changes itself.
+    """
+    def __init__(self, reparse, poll_interval):
+        self._reparse = reparse
+        self._poll_interval = poll_interval
+        self.alive = True
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._search_dirs = []
+        self._filetypes = []
+        self._files = []
+        self._changed = False
+        self._ready = {}
+
+        try:
+            self._backend = _Inotify()
+            self._timeout = _WAKEUP_INTERVAL
+        except (OSError, AttributeError):
+            self._backend = _StatPoller()
+            self._timeout = poll_interval
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def watch(self, search_dirs, filetypes, files):
+        """ Tells the watcher where to look. search_dirs is a list of (path,
+        shipped) tuples like SnippetManager._snippet_search_dirs returns them,
+        filetypes are the loaded filetypes and files their snippet files. """
+        with self._lock:
+            self._search_dirs = list(search_dirs)
+            self._filetypes = list(filetypes)
+            self._files = list(files)
+            self._changed = True
+        self._backend.wake()
+
+    def take(self, ft):
+        """ Returns what reparse returned for ft after its files changed or
+        None if they did not change since the last call. """
+        if not self._ready:
+            return None
+        with self._lock:
+            return self._ready.pop(ft, None)
+
+    def stop(self):
+        self._stop.set()
+        if self.alive:
+            self._backend.wake()
+
+    def _run(self):
+        try:
+            try:
+                self._loop([])
+            except Exception:
+                if isinstance(self._backend, _StatPoller):
+                    raise
+                # inotify failed. Poll instead and parse everything again,
+                # since we might have missed changes.
+                inotify, self._backend = self._backend, _StatPoller()
+                inotify.close()
+                self._timeout = self._poll_interval
+                with self._lock:
+                    self._changed = True
+                self._loop([(None, None)])
+        except Exception:
+            # We must never disturb the user from a background thread. Stop
+            # watching and let the main thread look for changes itself.
+            pass
+        finally:
+            self.alive = False
+            self._backend.close()
+
+    def _loop(self, events):
+        search_dirs, filetypes, files = [], [], []
+        while not self._stop.is_set():
+            with self._lock:
+                changed = self._changed
+                if changed:
+                    search_dirs = self._search_dirs
+                    filetypes = self._filetypes
+                    files = self._files
+                    self._changed = False
+            if changed or events:
+                # Directories for filetypes might have been created.
+                self._backend.watch(
+                        self._directories(search_dirs, filetypes), files)
+
+            for ft in self._affected(events, search_dirs, filetypes):
+                if self._stop.is_set():
+                    return
+                try:
+                    result = self._reparse(ft, search_dirs)
+                except Exception:
+                    continue
+                with self._lock:
+                    self._ready[ft] = result
+
+            events = self._backend.read(self._timeout)
+            while events:
+                more = self._backend.read(_SETTLE_TIME)
+                if not more:
+                    break
+                events.extend(more)
+
+    @staticmethod
+    def _directories(search_dirs, filetypes):
+        rv = set()
+        for path, shipped in search_dirs:
+            if not os.path.isdir(path):
+                continue
+            rv.add(path)
+            for ft in filetypes:
+                if os.path.isdir(os.path.join(path, ft)):
+                    rv.add(os.path.join(path, ft))
+        return rv
+
+    @staticmethod
+    def _affected(events, search_dirs, filetypes):
+        """ Returns the filetypes whose snippet files could have changed
+        because of events. """
+        top = set(path for path, shipped in search_dirs)
+        sub = {}
+        for path in top:
+            for ft in filetypes:
+                sub[os.path.join(path, ft)] = ft
+
+        rv = []
+        for path, name in events:
+            if path is None:
+                return list(filetypes)
+            if path in sub:
+                affected = [sub[path]]
+            elif name is None:
+                # A search directory itself disappeared or was moved.
+                return list(filetypes)
+            else:
+                affected = [ ft for ft in filetypes if name == ft or
+                        name == ft + ".snippets" or (name.startswith(ft + "_")
+                            and name.endswith(".snippets")) ]
+            for ft in affected:
+                if ft not in rv:
+                    rv.append(ft)
+        return rv
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+A persistent cache of parsed snippet files, so that unchanged files do not
+need to be parsed again when Vim is started the next time.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+__all__ = ["SnippetFileCache", "default_cache_dir"]
+
+def default_cache_dir():
+    """Returns $XDG_CACHE_HOME/ultisnips or ~/.cache/ultisnips."""
+    base = os.environ.get("XDG_CACHE_HOME") or \
+            os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "ultisnips")
+
+def _path_text(path):
+    """Returns path as text, which is how it is stored in an entry. Paths
+    are encoded in UTF-8 to name entries, so they are decoded the same way."""
+    if isinstance(path, bytes):
+        return path.decode("utf-8", "replace")
+    return path
+
+class SnippetFileCache(object):
+    """
+    Stores the parsed content of snippet files as one JSON file per snippet
+    file. An entry is only used if the content digest of the snippet file
+    matches the one it was created for. Entries that can not be read for any
+    reason are treated as missing. If the cache grows larger than max_size
+    bytes, the least recently used entries are removed. The snippet file
+    watcher writes entries from its own thread, so the bookkeeping of the
+    size is locked.
+    """
+    VERSION = 1
+
+    def __init__(self, directory, max_size):
+        self._dir = directory
+        self._max_size = max_size
+        # The size of all entries in bytes. None until the cache directory
+        # was looked at for the first time.
+        self._total = None
+        self._lock = threading.Lock()
+
+    def _entry_path(self, path):
+        if not isinstance(path, bytes):
+            path = path.encode("utf-8")
+        name = hashlib.sha1(path).hexdigest()
+        return os.path.join(self._dir, name + ".json")
+
+    def get(self, path, digest):
+        """Returns the parsed data for the snippet file at path with the given
+        content digest or None if we do not have it."""
+        entry_path = self._entry_path(path)
+        try:
+            with open(entry_path, "rb") as f:
+                entry = json.loads(f.read().decode("utf-8"))
+            if (entry["version"] != self.VERSION or
+                    entry["path"] != _path_text(path) or
+                    entry["digest"] != digest):
+                return None
+            data = entry["data"]
+            if not isinstance(data["globals"], dict) or \
+                    not isinstance(data["directives"], list):
+                raise ValueError("Malformed cache entry")
+        except (IOError, OSError):
+            return None
+        except Exception:
+            # Corrupted or written by something else. Get rid of it.
+            self._remove(entry_path)
+            return None
+
+        # Mark the entry as recently used.
+        try:
+            os.utime(entry_path, None)
+        except OSError:
+            pass
+        return data
+
+    def put(self, path, digest, data):
+        """Stores the parsed data for the snippet file at path."""
+        # Caching is an optimization only; never fail because of it.
+        try:
+            content = json.dumps({
+                "version": self.VERSION,
+                "path": _path_text(path),
+                "digest": digest,
+                "data": data,
+            }).encode("utf-8")
+            if not os.path.isdir(self._dir):
+                os.makedirs(self._dir)
+            fd, tmp_path = tempfile.mkstemp(dir=self._dir, suffix=".tmp")
+        except Exception:
+            return
+        entry_path = self._entry_path(path)
+        try:
+            old_size = os.stat(entry_path).st_size
+        except OSError:
+            old_size = 0
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(content)
+            self._replace(tmp_path, entry_path)
+        except Exception:
+            # _evict only looks at finished entries, so nobody else would
+            # ever remove it.
+            self._remove(tmp_path)
+            return
+        with self._lock:
+            if self._total is None:
+                self._evict()
+            else:
+                self._total += len(content) - old_size
+                if self._total > self._max_size:
+                    self._evict()
+
+    def _evict(self):
+        """Removes the least recently used entries until the cache is not
+        larger than our maximal size anymore. This looks at every entry, so
+        put only calls it the first time and when the running total says
+        that the cache got too large. Then a quarter of the maximal size is
+        freed, so that the next puts do not need to evict again."""
+        entries = []
+        total = 0
+        try:
+            names = os.listdir(self._dir)
+        except OSError:
+            self._total = None
+            return
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            entry_path = os.path.join(self._dir, name)
+            try:
+                st = os.stat(entry_path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, entry_path))
+            total += st.st_size
+
+        target = self._max_size
+        if total > target:
+            target -= self._max_size // 4
+        entries.sort()
+        for mtime, size, entry_path in entries:
+            if total <= target:
+                break
+            self._remove(entry_path)
+            total -= size
+        self._total = total
+
+    @staticmethod
+    def _replace(src, dst):
+        try:
+            os.rename(src, dst)
+        except OSError:
+            # Windows refuses to rename over an existing file.
+            os.remove(dst)
+            os.rename(src, dst)
+
+    @staticmethod
+    def _remove(entry_path):
+        try:
+            os.remove(entry_path)
+        except OSError:
+            pass
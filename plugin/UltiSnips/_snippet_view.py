@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+The snippets that are visible for one chain of filetypes, resolved once and
+reused until one of the underlying snippet dictionaries changes.
+"""
+
+__all__ = ["ResolvedView"]
+
+class ResolvedView(object):
+    """
+    Flattens the 'extends' hierarchy of an ordered tuple of filetypes into the
+    list of snippet dictionaries in priority order, like ('all', 'html',
+    'eruby'). Buffers with the same filetypes share one view.
+
+    The view stays valid as long as none of the dictionaries it was built
+    from changes its generation and none of the filetypes that had no
+    dictionary gets one.
+    """
+
+    def __init__(self, filetypes, dictionaries):
+        self._chain = []
+        self._missing = set()
+        for ft in reversed(filetypes):
+            self._flatten(ft, dictionaries, [])
+
+        unique = []
+        for sd in self._chain:
+            if sd not in unique:
+                unique.append(sd)
+        self._stamp = [ (sd, sd.generation) for sd in unique ]
+
+        self._end_chars = set()
+        for sd in unique:
+            if sd.end_chars is None:
+                self._end_chars = None
+                break
+            self._end_chars.update(sd.end_chars)
+
+        # Snippets that come before a snippet with the same trigger and the
+        # '!' option. Only if one of these is found we need to resolve
+        # overwrites at all.
+        self._overwritable = set()
+        overwriting = set()
+        for sd in reversed(self._chain):
+            for s in reversed(sd.snippets):
+                if s.trigger in overwriting:
+                    self._overwritable.add(s)
+                if s.overwrites_previous:
+                    overwriting.add(s.trigger)
+
+    def _flatten(self, ft, dictionaries, seen):
+        """ Appends the dictionaries for ft and its parents, parents first.
+        Parents reachable through several filetypes are listed every time. """
+        sd = dictionaries.get(ft)
+        if sd is None:
+            self._missing.add(ft)
+            return
+        seen.append(ft)
+        for p in sd.extends:
+            if p not in seen:
+                seen.append(p)
+                self._flatten(p, dictionaries, seen)
+        self._chain.append(sd)
+
+    def is_valid(self, dictionaries):
+        for ft in self._missing:
+            if ft in dictionaries:
+                return False
+        for sd, generation in self._stamp:
+            if sd.generation != generation:
+                return False
+        return True
+
+    def could_expand(self, before):
+        """ Returns False if no snippet can be triggered by a text ending like
+        before. """
+        return self._end_chars is None or before[-1:] in self._end_chars
+
+    def matching(self, before, possible):
+        """ Returns the snippets that match before in priority order. If
+        possible is True, those that could match after more typing are
+        returned. """
+        found_snippets = []
+        by_dict = {}
+        for sd in self._chain:
+            matches = by_dict.get(sd)
+            if matches is None:
+                matches = by_dict[sd] = sd.get_matching_snippets(
+                        before, possible)
+            found_snippets.extend(matches)
+
+        if not any(s in self._overwritable for s in found_snippets):
+            return found_snippets
+
+        # Search if any of the snippets overwrites the previous
+        # Dictionary allows O(1) access for easy overwrites
+        snippets = {}
+        for s in found_snippets:
+            if (s.trigger not in snippets) or s.overwrites_previous:
+                snippets[s.trigger] = []
+            snippets[s.trigger].append(s)
+
+        # Transform dictionary into flat list of snippets
+        selected_snippets = set([item for sublist in snippets.values() for item in sublist])
+        # Return snippets to their original order
+        return [snip for snip in found_snippets if snip in selected_snippets]
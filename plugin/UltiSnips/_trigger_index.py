@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Indexes the triggers of snippets so that the snippets that could match the
+text before the cursor can be found without looking at every snippet.
+"""
+
+import re
+
+__all__ = ["TriggerIndex", "regex_at_end", "words_for_line"]
+
+_WORD_BOUNDARY = re.compile(r'.\b.')
+_LEADING_FLAGS = re.compile(r'^\(\?[aiLmsux]+\)')
+# Back references, named groups, conditionals and inline flags either change
+# meaning or do not compile when patterns are joined into one alternation.
+_NOT_COMBINABLE = re.compile(r'\\[1-9]|\(\?[aiLmsuxP(]')
+# Old Pythons only support 100 groups in one regular expression.
+_MAX_GROUPS = 90
+
+def regex_at_end(pattern):
+    """Compiles pattern so that it only matches at the end of a string.
+    Returns None if this is not possible, for example if pattern is not a
+    valid regular expression."""
+    flags = _LEADING_FLAGS.match(pattern)
+    flags = flags.group(0) if flags else ""
+    try:
+        return re.compile(r"%s(?:%s)\Z" % (flags, pattern[len(flags):]))
+    except Exception:
+        return None
+
+def _combine_regex_triggers(snippets):
+    """Joins the triggers of the given regular expression snippets into as
+    few end anchored alternations as possible. Returns a list of (regex,
+    snippets) tuples; no snippet in snippets can match a text that regex does
+    not match. Snippets that can not be combined come with None as regex."""
+    rv = []
+    parts, part_snippets, groups = [], [], 0
+
+    def _flush():
+        if parts:
+            rv.append((re.compile(r"(?:%s)\Z" % "|".join(parts)),
+                part_snippets))
+
+    for snippet in snippets:
+        pattern = snippet.trigger
+        try:
+            ngroups = re.compile(pattern).groups
+        except Exception:
+            ngroups = None
+        if ngroups is None or ngroups >= _MAX_GROUPS or \
+                _NOT_COMBINABLE.search(pattern):
+            rv.append((None, [snippet]))
+            continue
+        if groups + ngroups >= _MAX_GROUPS:
+            _flush()
+            parts, part_snippets, groups = [], [], 0
+        parts.append("(?:%s)" % pattern)
+        part_snippets.append(snippet)
+        groups += ngroups
+    _flush()
+    return rv
+
+def words_for_line(before, num_words):
+    """ Gets the final num_words words from before. """
+    if not len(before):
+        return ''
+
+    word_list = before.split()
+    if len(word_list) <= num_words:
+        return before.strip()
+    else:
+        before_words = before
+        for i in range(-1, -(num_words + 1), -1):
+            left = before_words.rfind(word_list[i])
+            before_words = before_words[:left]
+        return before[len(before_words):].strip()
+
+class _TrieNode(object):
+    __slots__ = ("children", "snippets")
+
+    def __init__(self):
+        self.children = {}
+        self.snippets = []
+
+class _PrefixTrie(object):
+    """A trie over trigger strings that finds all triggers with a given
+    prefix in O(len(prefix) + number of results)."""
+
+    def __init__(self):
+        self._root = _TrieNode()
+
+    def add(self, key, snippet):
+        node = self._root
+        for c in key:
+            child = node.children.get(c)
+            if child is None:
+                child = node.children[c] = _TrieNode()
+            node = child
+        node.snippets.append(snippet)
+
+    def remove(self, key, snippet):
+        path = []
+        node = self._root
+        for c in key:
+            path.append((node, c))
+            node = node.children[c]
+        node.snippets.remove(snippet)
+
+        # Prune nodes that lead nowhere anymore
+        while path and not node.snippets and not node.children:
+            node, c = path.pop()
+            del node.children[c]
+
+    def with_prefix(self, prefix):
+        node = self._root
+        for c in prefix:
+            node = node.children.get(c)
+            if node is None:
+                return []
+        rv = []
+        todo = [node]
+        while todo:
+            node = todo.pop()
+            rv.extend(node.snippets)
+            todo.extend(node.children.values())
+        return rv
+
+class _SuffixTrie(_PrefixTrie):
+    """A trie over reversed trigger strings. It finds all triggers that are
+    a suffix of a text by walking the text backwards once, so the cost is
+    bounded by the length of the longest trigger."""
+
+    def add(self, key, snippet):
+        _PrefixTrie.add(self, key[::-1], snippet)
+
+    def remove(self, key, snippet):
+        _PrefixTrie.remove(self, key[::-1], snippet)
+
+    def ending(self, text):
+        """Returns (length, snippet) for each trigger text ends with."""
+        node = self._root
+        rv = [ (0, s) for s in node.snippets ]
+        for idx in range(len(text) - 1, -1, -1):
+            node = node.children.get(text[idx])
+            if node is None:
+                break
+            length = len(text) - idx
+            rv.extend((length, s) for s in node.snippets)
+        return rv
+
+class TriggerIndex(object):
+    """
+    Finds candidate snippets for a text before the cursor. Snippets without
+    any of the options 'w', 'i' and 'r' are found by their trigger through a
+    dictionary, separately for each number of words in the trigger. 'w' and
+    'i' snippets with single word triggers are found by walking the text
+    before the cursor backwards through a trie of their reversed triggers. All
+    but regular expression snippets are also kept in a prefix trie for
+    could_match. Everything else is kept in side buckets and always returned
+    as candidate.
+
+    The returned candidates are a superset of the matching snippets, sorted
+    by the rank they were added with. The caller still needs to ask each
+    candidate if it really matches.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._ranks = {}
+        self._exact = {}
+        self._prefix = {}
+        self._suffix = _SuffixTrie()
+        self._inword = []
+        self._regex = []
+        self._regex_filters = []
+        self._end_chars = {}
+        self._ends_anywhere = 0
+
+    def __len__(self):
+        return len(self._ranks)
+
+    def rank(self, snippet):
+        """Returns the rank snippet was added with."""
+        return self._ranks[snippet]
+
+    @property
+    def end_chars(self):
+        """The set of characters that a text must end with for any of our
+        snippets to match it. None if we can not tell, for example because
+        there are regular expression triggers."""
+        if self._ends_anywhere:
+            return None
+        return frozenset(self._end_chars)
+
+    def _count_end_char(self, snippet, delta):
+        trigger = snippet.trigger
+        if snippet.has_option("r") or not trigger:
+            self._ends_anywhere += delta
+            return
+        c = trigger[-1]
+        self._end_chars[c] = self._end_chars.get(c, 0) + delta
+        if not self._end_chars[c]:
+            del self._end_chars[c]
+
+    def add(self, snippet, rank):
+        self._ranks[snippet] = rank
+        self._count_end_char(snippet, 1)
+
+        trigger = snippet.trigger
+        num_words = len(trigger.split())
+        if snippet.has_option("r"):
+            self._regex.append(snippet)
+            self._regex_filters = None
+            return
+
+        if num_words not in self._prefix:
+            self._prefix[num_words] = _PrefixTrie()
+        self._prefix[num_words].add(trigger, snippet)
+        if snippet.has_option("w") or snippet.has_option("i"):
+            if num_words <= 1:
+                self._suffix.add(trigger, snippet)
+            else:
+                self._inword.append(snippet)
+        else:
+            by_trigger = self._exact.setdefault(num_words, {})
+            by_trigger.setdefault(trigger, []).append(snippet)
+
+    def remove(self, snippet):
+        del self._ranks[snippet]
+        self._count_end_char(snippet, -1)
+
+        trigger = snippet.trigger
+        num_words = len(trigger.split())
+        if snippet.has_option("r"):
+            self._regex.remove(snippet)
+            self._regex_filters = None
+            return
+
+        self._prefix[num_words].remove(trigger, snippet)
+        if snippet.has_option("w") or snippet.has_option("i"):
+            if num_words <= 1:
+                self._suffix.remove(trigger, snippet)
+            else:
+                self._inword.remove(snippet)
+        else:
+            by_trigger = self._exact[num_words]
+            by_trigger[trigger].remove(snippet)
+            if not by_trigger[trigger]:
+                del by_trigger[trigger]
+
+    def candidates(self, before, potentially):
+        """Returns the snippets that might match before, either exactly or,
+        if potentially is True, as the beginning of their trigger."""
+        if not potentially:
+            # Nothing ever expands on whitespace
+            if before and before.rstrip() != before:
+                return []
+            rv = self._regex_candidates(before)
+            rv.extend(self._inword)
+            rv.extend(self._ending_inword(before))
+            for num_words, by_trigger in self._exact.items():
+                rv.extend(by_trigger.get(
+                    words_for_line(before, num_words), ()))
+        else:
+            # could_match lists everything on whitespace
+            if before and before[-1] in (" ", "\t"):
+                before = ""
+            rv = self._regex_candidates(before)
+            for num_words, trie in self._prefix.items():
+                rv.extend(trie.with_prefix(words_for_line(before, num_words)))
+        return sorted(rv, key=self._ranks.__getitem__)
+
+    def _regex_candidates(self, before):
+        """Returns the regular expression snippets that might match before.
+        All of them are checked with one search per combined expression."""
+        if self._regex_filters is None:
+            self._regex_filters = _combine_regex_triggers(self._regex)
+        rv = []
+        for regex, snippets in self._regex_filters:
+            if regex is None or regex.search(before):
+                rv.extend(snippets)
+        return rv
+
+    def _ending_inword(self, before):
+        """Returns the 'w' and 'i' snippets whose trigger ends at the end of
+        before. For 'w' snippets, the trigger must also start at a word
+        boundary."""
+        rv = []
+        for length, snippet in self._suffix.ending(before):
+            if snippet.has_option("w") and 0 < length < len(before):
+                prev = before[-length - 1]
+                if not prev.isspace() and not _WORD_BOUNDARY.match(
+                        prev + before[-length]):
+                    continue
+            rv.append(snippet)
+        return rv
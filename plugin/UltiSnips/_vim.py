@@ -4,39 +4,56 @@
 """
 Wrapper functionality around the functions we need from Vim
 """
+from collections import namedtuple
 import re
 
 import vim
 from vim import error
 
 from UltiSnips.geometry import Position
+from UltiSnips import compatibility
 from UltiSnips.compatibility import col2byte, byte2col, \
-        as_unicode, as_vimencoding
+        as_unicode, as_vimencoding, encoding_changed
+
+# Number of calls into Vim, by the entry point of SnippetManager that made
+# them. Calls made outside of any entry point are counted for None.
+call_counts = {}
+_entry_point = None
+
+def _count_call():
+    call_counts[_entry_point] = call_counts.get(_entry_point, 0) + 1
+compatibility.on_vim_call = _count_call
 
 class VimBuffer(object):
     def __getitem__(self, idx):
         if isinstance(idx, slice): # Py3
             return self.__getslice__(idx.start, idx.stop)
+        _count_call()
         rv = vim.current.buffer[idx]
         return as_unicode(rv)
     def __getslice__(self, i, j):
+        _count_call()
         rv = vim.current.buffer[i:j]
         return [ as_unicode(l) for l in rv ]
 
     def __setitem__(self, idx, text):
         if isinstance(idx, slice): # Py3
             return self.__setslice__(idx.start, idx.stop, text)
+        _state_changed()
         vim.current.buffer[idx] = as_vimencoding(text)
     def __setslice__(self, i, j, text):
+        _state_changed()
         vim.current.buffer[i:j] = [ as_vimencoding(l) for l in text ]
 
     def __len__(self):
+        _count_call()
         return len(vim.current.buffer)
 
     @property
     def current_line_splitted(self):
         """Returns the text before and after the cursor as a tuple."""
         # Note: we want byte position here
+        _count_call()
         lineno, col = vim.current.window.cursor
 
         line = vim.current.line
@@ -53,11 +70,13 @@ class VimBuffer(object):
         based in line which is different from Vim's cursor.
         """
         def fget(self):
+            _count_call()
             line, nbyte = vim.current.window.cursor
             col = byte2col(line, nbyte)
             return Position(line - 1, col)
         def fset(self, pos):
             nbyte = col2byte(pos.line + 1, pos.col)
+            _count_call()
             vim.current.window.cursor = pos.line + 1, nbyte
         return locals()
     cursor = property(**cursor())
@@ -80,7 +99,7 @@ def text_to_vim(start, end, text):
 
     # Open any folds this might have created
     buf.cursor = start
-    vim.command("normal! zv")
+    command("normal! zv")
 
     return new_end
 
@@ -101,14 +120,146 @@ def escape(inp):
     return conv(inp)
 
 def command(s):
+    _state_changed()
     return as_unicode(vim.command(as_vimencoding(s)))
 
 def eval(s):
+    _count_call()
     rv = vim.eval(as_vimencoding(s))
     if not isinstance(rv, (dict, list)):
         return as_unicode(rv)
     return rv
 
+def eval_many(exprs):
+    """Evaluates the Vim expressions in the list exprs in one call and returns
+    the list of their values. Values are converted like eval does it."""
+    _count_call()
+    rv = vim.eval(as_vimencoding("[" + ",".join(exprs) + "]"))
+    return [ v if isinstance(v, (dict, list)) else as_unicode(v) for v in rv ]
+
+class VimSnapshot(namedtuple("VimSnapshot",
+        "mode visualmode selection visual_start visual_end changedtick")):
+    """
+    The state of Vim that event handlers ask for most often, read in one
+    call. visual_start and visual_end are the 0 based (line, column) tuples
+    of the marks '< and '>, with the column in bytes. changedtick is
+    b:changedtick of the current buffer.
+    """
+    __slots__ = ()
+
+    _EXPRS = ("mode()", "visualmode()", "&selection", 'getpos("\'<")',
+            'getpos("\'>")', "b:changedtick")
+
+    @classmethod
+    def read(cls):
+        mode, visualmode, selection, visual_start, visual_end, changedtick = \
+                eval_many(cls._EXPRS)
+        return cls(mode, visualmode, selection,
+                (int(visual_start[1]) - 1, int(visual_start[2]) - 1),
+                (int(visual_end[1]) - 1, int(visual_end[2]) - 1),
+                int(changedtick))
+
+_snapshot = None
+_in_event = False
+
+def snapshot():
+    """Returns a VimSnapshot of the current state. While an event is handled,
+    the same snapshot is returned until a command is run, the buffer is
+    changed or snippet code ran, because only those can change what it
+    contains."""
+    global _snapshot
+    if not _in_event:
+        return VimSnapshot.read()
+    if _snapshot is None:
+        _snapshot = VimSnapshot.read()
+    return _snapshot
+
+def _state_changed():
+    _count_call()
+    forget_snapshot()
+
+def forget_snapshot():
+    """Makes the next snapshot() read Vim again. Called after code that we do
+    not control ran, like python and vimscript interpolation in snippets,
+    because it can run any command behind our back."""
+    global _snapshot
+    _snapshot = None
+
+def begin_event(entry_point):
+    """Called when the entry point entry_point of SnippetManager starts to
+    handle an event. Returns what end_event needs to restore the outer state
+    for nested events."""
+    global _snapshot, _in_event, _entry_point
+    outer = _snapshot, _in_event, _entry_point
+    _snapshot, _in_event, _entry_point = None, True, entry_point
+    return outer
+
+def end_event(outer):
+    global _snapshot, _in_event, _entry_point
+    _snapshot, _in_event, _entry_point = outer
+
+def reset_call_counts():
+    call_counts.clear()
+
+# Options whose changes plugin/UltiSnips.vim reports to us through the
+# OptionSet autocommand. Only these can be remembered between calls.
+WATCHED_OPTIONS = ("encoding", "runtimepath", "langmap")
+# The buffer local options that IndentUtil needs. They are reported the same
+# way and remembered for each buffer.
+INDENT_OPTIONS = ("shiftwidth", "softtabstop", "expandtab", "tabstop")
+_options = {}
+_indent_settings = {}
+_has_option_set = None
+
+def _can_remember_options():
+    global _has_option_set
+    if _has_option_set is None:
+        _has_option_set = eval("exists('##OptionSet')") == "1"
+    return _has_option_set
+
+def option(name):
+    """Returns the value of the option name. Watched options are only read
+    again from Vim after they were changed."""
+    if not _can_remember_options() or name not in WATCHED_OPTIONS:
+        return eval("&" + name)
+    if name not in _options:
+        _options[name] = eval("&" + name)
+    return _options[name]
+
+def indent_settings():
+    """Returns (shiftwidth, softtabstop, expandtab, tabstop) for the current
+    buffer. They are only read again from Vim after one of them changed."""
+    if not _can_remember_options():
+        return _read_indent_settings()
+    _count_call()
+    nr = vim.current.buffer.number
+    rv = _indent_settings.get(nr)
+    if rv is None:
+        rv = _indent_settings[nr] = _read_indent_settings()
+    return rv
+
+def _read_indent_settings():
+    sw, sts, et, ts = eval_many(("&sw", "&sts", "&expandtab", "&ts"))
+    return int(sw), int(sts), et == "1", int(ts)
+
+def forget_indent_settings():
+    """Makes indent_settings read the options of the current buffer again."""
+    _count_call()
+    _indent_settings.pop(vim.current.buffer.number, None)
+
+def option_changed(name=None):
+    """Forgets the remembered value of the option name or of all options if
+    name is None."""
+    if name is None:
+        _options.clear()
+        _indent_settings.clear()
+    elif name in INDENT_OPTIONS:
+        forget_indent_settings()
+    else:
+        _options.pop(name, None)
+    if name in (None, "encoding"):
+        encoding_changed()
+
 def feedkeys(s, mode='n'):
     """Wrapper around vim's feedkeys function. Mainly for convenience."""
     command(as_unicode(r'call feedkeys("%s", "%s")') % (s, mode))
@@ -119,6 +270,7 @@ def new_scratch_buffer(text):
     command("set ft=text")
     command("set buftype=nofile")
 
+    _state_changed()
     vim.current.buffer[:] = text.splitlines()
 
     feedkeys(r"\<Esc>")
@@ -132,15 +284,17 @@ def select(start, end):
     lineno, col = start.line, start.col
 
     col = col2byte(lineno + 1, col)
+    _count_call()
     vim.current.window.cursor = lineno + 1, col
 
+    state = snapshot()
     move_cmd = ""
-    if eval("mode()") != 'n':
+    if state.mode != 'n':
         move_cmd += r"\<Esc>"
 
     # Case 1: Zero Length Tabstops
     if delta.line == delta.col == 0:
-        if col == 0 or eval("mode()") not in 'i' and \
+        if col == 0 or state.mode not in 'i' and \
                 col < len(buf[lineno]):
             move_cmd += "i"
         else:
@@ -166,7 +320,7 @@ def select(start, end):
         # Depending on the current mode and position, we
         # might need to move escape out of the mode and this
         # will move our cursor one left
-        if col != 0 and eval("mode()") == 'i':
+        if col != 0 and state.mode == 'i':
             move_one_right = "l"
         else:
             move_one_right = ""
@@ -175,7 +329,7 @@ def select(start, end):
         # and select right from there. Note that the we have to select
         # one column less since Vim's visual selection is including the
         # ending while Python slicing is excluding the ending.
-        inclusive = "inclusive" in eval("&selection")
+        inclusive = "inclusive" in state.selection
         if end.col == 0:
             # Selecting should end at beginning of line -> Select the
             # previous line till its end
@@ -201,70 +355,95 @@ def _calc_end(lines, start):
         new_end = Position(start.line + len(lines)-1, len(lines[-1]))
     return new_end
 
+# The value of g:_ulti_mappings_tick and the mappings to ignore of each
+# buffer when we last removed mappings there. plugin/UltiSnips.vim counts up
+# the tick on the events after which mappings might have changed.
+_smap_states = {}
+_has_execute = None
+
+def _read_select_mode_mappings():
+    """Returns the output of ':smap <buffer>' and ':smap'."""
+    global _has_execute
+    if _has_execute is None:
+        _has_execute = eval("exists('*execute')") == "1"
+    if _has_execute:
+        return [ as_unicode(l) for l in
+                eval("[execute('smap <buffer>'), execute('smap')]") ]
+    command("redir => _tmp_smaps_buffer | silent smap <buffer> | redir END | "
+            "redir => _tmp_smaps | silent smap | redir END")
+    return eval_many(("_tmp_smaps_buffer", "_tmp_smaps"))
+
 def _unmap_select_mode_mapping():
     """This function unmaps select mode mappings if so wished by the user.
     Removes select mode mappings that can actually be typed by the user
-    (ie, ignores things like <Plug>).
+    (ie, ignores things like <Plug>). This is only done again for a buffer
+    if mappings might have changed since the last time, which Vim tells us
+    through g:_ulti_mappings_tick, or if the mappings to ignore changed.
     """
-    if int(eval("g:UltiSnipsRemoveSelectModeMappings")):
-        ignores = eval("g:UltiSnipsMappingsToIgnore") + ['UltiSnips']
-
-        for option in ("<buffer>", ""):
-            # Put all smaps into a var, and then read the var
-            command(r"redir => _tmp_smaps | silent smap %s " % option +
-                        "| redir END")
-
-            # Check if any mappings where found
-            all_maps = list(filter(len, eval(r"_tmp_smaps").splitlines()))
-            if (len(all_maps) == 1 and all_maps[0][0] not in " sv"):
-                # "No maps found". String could be localized. Hopefully
-                # it doesn't start with any of these letters in any
-                # language
+    rv = eval("g:UltiSnipsRemoveSelectModeMappings ? [bufnr('%'), "
+            "g:_ulti_mappings_tick, g:UltiSnipsMappingsToIgnore] : []")
+    if not rv:
+        return
+    nr, state = rv[0], (rv[1], tuple(rv[2]))
+    if _smap_states.get(nr) == state:
+        return
+
+    ignores = list(state[1]) + ['UltiSnips']
+    for option, listing in zip(("<buffer>", ""),
+            _read_select_mode_mappings()):
+        # Check if any mappings where found
+        all_maps = list(filter(len, listing.splitlines()))
+        if (len(all_maps) == 1 and all_maps[0][0] not in " sv"):
+            # "No maps found". String could be localized. Hopefully
+            # it doesn't start with any of these letters in any
+            # language
+            continue
+
+        # Only keep mappings that should not be ignored
+        maps = [m for m in all_maps if
+                    not any(i in m for i in ignores) and len(m.strip())]
+
+        for m in maps:
+            # The first three chars are the modes, that might be listed.
+            # We are not interested in them here.
+            trig = m[3:].split()[0] if len(m[3:].split()) != 0 else None
+
+            if trig is None:
                 continue
 
-            # Only keep mappings that should not be ignored
-            maps = [m for m in all_maps if
-                        not any(i in m for i in ignores) and len(m.strip())]
-
-            for m in maps:
-                # The first three chars are the modes, that might be listed.
-                # We are not interested in them here.
-                trig = m[3:].split()[0] if len(m[3:].split()) != 0 else None
-
-                if trig is None:
+            # The bar separates commands
+            if trig[-1] == "|":
+                trig = trig[:-1] + "<Bar>"
+
+            # Special ones
+            if trig[0] == "<":
+                add = False
+                # Only allow these
+                for valid in ["Tab", "NL", "CR", "C-Tab", "BS"]:
+                    if trig == "<%s>" % valid:
+                        add = True
+                if not add:
                     continue
 
-                # The bar separates commands
-                if trig[-1] == "|":
-                    trig = trig[:-1] + "<Bar>"
-
-                # Special ones
-                if trig[0] == "<":
-                    add = False
-                    # Only allow these
-                    for valid in ["Tab", "NL", "CR", "C-Tab", "BS"]:
-                        if trig == "<%s>" % valid:
-                            add = True
-                    if not add:
-                        continue
-
-                # UltiSnips remaps <BS>. Keep this around.
-                if trig == "<BS>":
-                    continue
+            # UltiSnips remaps <BS>. Keep this around.
+            if trig == "<BS>":
+                continue
 
-                # Actually unmap it
-                try:
-                    command("silent! sunmap %s %s" % (option, trig))
-                except:
-                    # Bug 908139: ignore unmaps that fail because of
-                    # unprintable characters. This is not ideal because we
-                    # will not be able to unmap lhs with any unprintable
-                    # character. If the lhs stats with a printable
-                    # character this will leak to the user when he tries to
-                    # type this character as a first in a selected tabstop.
-                    # This case should be rare enough to not bother us
-                    # though.
-                    pass
+            # Actually unmap it
+            try:
+                command("silent! sunmap %s %s" % (option, trig))
+            except:
+                # Bug 908139: ignore unmaps that fail because of
+                # unprintable characters. This is not ideal because we
+                # will not be able to unmap lhs with any unprintable
+                # character. If the lhs stats with a printable
+                # character this will leak to the user when he tries to
+                # type this character as a first in a selected tabstop.
+                # This case should be rare enough to not bother us
+                # though.
+                pass
+
+    _smap_states[nr] = state
 # End:  Helper functions  }}}
 # Helper classes  {{{
 class _Real_LangMapTranslator(object):
@@ -294,20 +473,25 @@ class _Real_LangMapTranslator(object):
             else:
                 from_chars += c[::2]
                 to_chars += c[1::2]
-        self._maps[langmap] = (from_chars, to_chars)
+
+        # A table for unicode.translate that maps back: we must send the
+        # character that langmap turns into the one we want. All characters
+        # are translated at once, so a character that is the result of one
+        # mapping is never translated again by another. If several
+        # characters map to the same one, the first wins.
+        table = {}
+        for f, t in zip(from_chars, to_chars):
+            table.setdefault(ord(t), f)
+        self._maps[langmap] = table
 
     def translate(self, s):
-        langmap = eval("&langmap").strip()
+        langmap = option("langmap").strip()
         if langmap == "":
             return s
 
-        s = as_unicode(s)
         if langmap not in self._maps:
             self._create_translation(langmap)
-
-        for f,t in zip(*self._maps[langmap]):
-            s = s.replace(f,t)
-        return s
+        return as_unicode(s).translate(self._maps[langmap])
 
 class _Dummy_LangMapTranslator(object):
     """
@@ -6,33 +6,159 @@ This file contains compatibility code to stay compatible with
 as many python versions as possible.
 """
 
+import codecs
+import io
 import sys
 
 import vim
 
 __all__ = ['as_unicode', 'compatible_exec', 'vim_cursor', 'set_vim_cursor']
 
+# The (decode, encode) functions for &encoding. They are only looked up again
+# after encoding_changed() if Vim can tell us about changes through OptionSet.
+_codec = None
+_can_cache_codec = None
+
+# Called before each call into Vim that is made here. UltiSnips._vim sets it
+# to count these calls with its own.
+on_vim_call = lambda: None
+
+def _utf8_decode(s):
+    return s.decode("utf-8")
+
+def _utf8_encode(s):
+    return s.encode("utf-8")
+
+def _lookup_codec():
+    on_vim_call()
+    encoding = vim.eval("&encoding")
+    if encoding in ("utf-8", "utf8"):
+        return _utf8_decode, _utf8_encode
+    try:
+        info = codecs.lookup(encoding)
+    except LookupError:
+        # Fail on use, just like we always did.
+        return (lambda s: s.decode(encoding)), (lambda s: s.encode(encoding))
+    return (lambda s: info.decode(s)[0]), (lambda s: info.encode(s)[0])
+
+def _get_codec():
+    global _codec, _can_cache_codec
+    if _codec is not None:
+        return _codec
+    if _can_cache_codec is None:
+        on_vim_call()
+        _can_cache_codec = vim.eval("exists('##OptionSet')") == "1"
+    codec = _lookup_codec()
+    if _can_cache_codec:
+        _codec = codec
+    return codec
+
+def encoding_changed():
+    """Forgets the codec for &encoding. Called when Vim tells us that the
+    option was set."""
+    global _codec
+    _codec = None
+    _line_offsets.clear()
+
 def _vim_dec(s):
     try:
-        return s.decode(vim.eval("&encoding"))
+        return _get_codec()[0](s)
     except UnicodeDecodeError:
         # At least we tried. There might be some problems down the road now
         return s
 
 def _vim_enc(s):
     try:
-        return s.encode(vim.eval("&encoding"))
+        return _get_codec()[1](s)
     except UnicodeEncodeError:
         return s
 
+def _slice_len(stop, length):
+    """Returns len(seq[:stop]) for a sequence of the given length."""
+    if stop < 0:
+        return max(0, length + stop)
+    return min(stop, length)
+
+class _LineOffsets(object):
+    """
+    The byte offset of every character in one line of the buffer, so that
+    converting between columns and byte indices does not need to encode or
+    decode anything. Lines in which every character is a single byte need no
+    table at all.
+    """
+    __slots__ = ("chars", "bytes", "offsets", "columns")
+
+    def __init__(self, text, encoded):
+        self.chars = len(text)
+        self.bytes = len(encoded)
+        self.offsets = None
+        self.columns = None
+        if self.chars != self.bytes:
+            offsets = [0]
+            for c in text:
+                offsets.append(offsets[-1] + len(_vim_enc(c)))
+            if offsets[-1] != self.bytes:
+                raise ValueError("line does not encode character by character")
+            self.offsets = offsets
+            self.columns = dict((o, i) for i, o in enumerate(offsets))
+
+    def col2byte(self, col):
+        col = _slice_len(col, self.chars)
+        if self.offsets is None:
+            return col
+        return self.offsets[col]
+
+    def byte2col(self, nbyte):
+        nbyte = _slice_len(nbyte, self.bytes)
+        if self.offsets is None:
+            return nbyte
+        # Decoding fails inside of a character and we end up counting bytes.
+        return self.columns.get(nbyte, nbyte)
+
+# _LineOffsets for recently converted lines by (buffer number, line number),
+# together with the content of the line they were computed for.
+_line_offsets = {}
+_LINE_OFFSETS_SIZE = 64
+
+def _offsets_for(line):
+    """Returns the _LineOffsets for the line (1 based) in the current buffer
+    or None if its characters can not be mapped to bytes one by one."""
+    on_vim_call()
+    buf = vim.current.buffer
+    content = buf[line-1]
+    key = (buf.number, line)
+    entry = _line_offsets.get(key)
+    if entry is not None and entry[0] == content:
+        return entry[1]
+
+    text, encoded = _text_and_bytes(content)
+    try:
+        offsets = _LineOffsets(text, encoded) if text is not None else None
+    except ValueError:
+        offsets = None
+    if len(_line_offsets) >= _LINE_OFFSETS_SIZE:
+        _line_offsets.clear()
+    _line_offsets[key] = (content, offsets)
+    return offsets
+
 if sys.version_info >= (3,0):
     from UltiSnips.compatibility_py3 import *
 
+    def _text_and_bytes(line):
+        encoded = _vim_enc(line)
+        if not isinstance(encoded, bytes):
+            return None, None
+        return line, encoded
+
     def col2byte(line, col):
         """
         Convert a valid column index into a byte index inside
         of vims buffer.
         """
+        offsets = _offsets_for(line)
+        if offsets is not None:
+            return offsets.col2byte(col)
+        on_vim_call()
         pre_chars = vim.current.buffer[line-1][:col]
         return len(_vim_enc(pre_chars))
 
@@ -41,6 +167,10 @@ if sys.version_info >= (3,0):
         Convert a column into a byteidx suitable for a mark or cursor
         position inside of vim
         """
+        offsets = _offsets_for(line)
+        if offsets is not None:
+            return offsets.byte2col(nbyte)
+        on_vim_call()
         line = vim.current.buffer[line-1]
         raw_bytes = _vim_enc(line)[:nbyte]
         return len(_vim_dec(raw_bytes))
@@ -52,17 +182,32 @@ if sys.version_info >= (3,0):
 
     def as_vimencoding(s):
         return s
+
+    def file_lines(data):
+        """Splits the raw content of a text file into lines just like
+        open(fn).readlines() would."""
+        return io.TextIOWrapper(io.BytesIO(data)).readlines()
 else:
     from UltiSnips.compatibility_py2 import *
 
     import warnings
     warnings.filterwarnings("ignore", category=DeprecationWarning)
 
+    def _text_and_bytes(line):
+        text = _vim_dec(line)
+        if not isinstance(text, unicode):
+            return None, None
+        return text, line
+
     def col2byte(line, col):
         """
         Convert a valid column index into a byte index inside
         of vims buffer.
         """
+        offsets = _offsets_for(line)
+        if offsets is not None:
+            return offsets.col2byte(col)
+        on_vim_call()
         pre_chars = _vim_dec(vim.current.buffer[line-1])[:col]
         return len(_vim_enc(pre_chars))
 
@@ -71,6 +216,12 @@ else:
         Convert a column into a byteidx suitable for a mark or cursor
         position inside of vim
         """
+        offsets = _offsets_for(line)
+        if offsets is not None:
+            if nbyte >= offsets.bytes: # This is beyond end of line
+                return nbyte
+            return offsets.byte2col(nbyte)
+        on_vim_call()
         line = vim.current.buffer[line-1]
         if nbyte >= len(line): # This is beyond end of line
             return nbyte
@@ -84,3 +235,7 @@ else:
     def as_vimencoding(s):
         return _vim_enc(s)
 
+    def file_lines(data):
+        """Splits the raw content of a text file into lines just like
+        open(fn).readlines() would."""
+        return io.BytesIO(data).readlines()
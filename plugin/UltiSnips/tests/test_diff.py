@@ -1,11 +1,14 @@
 #!/usr/bin/env python
 # encoding: utf-8
 
+import random
+import time
 import unittest
 
 import os.path as p, sys; sys.path.append(p.join(p.dirname(__file__), ".."))
 
-from _diff import diff, guess_edit
+import _diff
+from _diff import diff, guess_edit, is_complete_edit
 from geometry import Position
 
 
@@ -29,9 +32,20 @@ def transform(a, cmds):
 import unittest
 
 # Test Guessing  {{{
+class _VimPosition(Position):
+    def __init__(self, line, col, mode):
+        Position.__init__(self, line, col)
+        self.mode = mode
+
+class _VimState(object):
+    def __init__(self, ppos, pos, mode):
+        self.ppos = _VimPosition(ppos[0], ppos[1], mode)
+        self.pos = _VimPosition(pos[0], pos[1], mode)
+
 class _BaseGuessing(object):
+    mode = "i"
     def runTest(self):
-        rv, es = guess_edit(self.initial_line, self.a, self.b, Position(*self.ppos), Position(*self.pos))
+        rv, es = guess_edit(self.initial_line, self.a, self.b, _VimState(self.ppos, self.pos, self.mode))
         self.assertEqual(rv, True)
         self.assertEqual(self.wanted, es)
 
@@ -69,6 +83,63 @@ class TestGuessing_DeleteOneChar(_BaseGuessing, unittest.TestCase):
     wanted = (
         ("D", 0, 5, " "),
     )
+class TestGuessing_OpenLineWithIndent(_BaseGuessing, unittest.TestCase):
+    a, b = ["    foo"], ["    foo", "    "]
+    initial_line = 0
+    ppos, pos = (0, 7), (1, 4)
+    wanted = (
+        ("I", 0, 7, "\n"),
+        ("I", 1, 0, "    "),
+    )
+class TestGuessing_OpenLineAbove(_BaseGuessing, unittest.TestCase):
+    a, b = ["foo"], ["", "foo"]
+    initial_line = 3
+    ppos, pos = (3, 1), (3, 0)
+    wanted = (
+        ("I", 3, 0, "\n"),
+    )
+class TestGuessing_JoinLines(_BaseGuessing, unittest.TestCase):
+    a, b = ["foo", "    bar"], ["foo bar"]
+    initial_line = 0
+    ppos, pos = (0, 1), (0, 3)
+    mode = "n"
+    wanted = (
+        ("D", 0, 3, "\n"),
+        ("D", 0, 3, "   "),
+    )
+class TestGuessing_CycleCompletion(_BaseGuessing, unittest.TestCase):
+    a, b = ["x = foobar"], ["x = foobaz"]
+    initial_line = 0
+    ppos, pos = (0, 10), (0, 10)
+    wanted = (
+        ("D", 0, 9, "r"),
+        ("I", 0, 9, "z"),
+    )
+class TestGuessing_BackspaceOverLineBreak(_BaseGuessing, unittest.TestCase):
+    a, b = ["foo", "bar"], ["foobar"]
+    initial_line = 0
+    ppos, pos = (1, 0), (0, 3)
+    wanted = (
+        ("D", 0, 3, "\n"),
+    )
+class TestGuessing_PasteLines(_BaseGuessing, unittest.TestCase):
+    a, b = ["ab"], ["aX", "Yb"]
+    initial_line = 0
+    ppos, pos = (0, 1), (1, 1)
+    wanted = (
+        ("I", 0, 1, "X"),
+        ("I", 0, 2, "\n"),
+        ("I", 1, 0, "Y"),
+    )
+class TestGuessing_BlockInsert(_BaseGuessing, unittest.TestCase):
+    a, b = ["ab", "cd", "e"], ["aXb", "cXd", "e"]
+    initial_line = 0
+    ppos, pos = (0, 1), (0, 1)
+    mode = "n"
+    wanted = (
+        ("I", 0, 1, "X"),
+        ("I", 1, 1, "X"),
+    )
 
 # End: Test Guessing  }}}
 
@@ -179,6 +250,105 @@ class MultiLine(_Base, unittest.TestCase):
         ("I", 1, 12, "k"),
     )
 
+class DeletionStaysInItsLines(_Base, unittest.TestCase):
+    a = "a\nbaa"
+    b = "a"
+
+    wanted = (
+        ("D", 0, 1, "\n"),
+        ("D", 0, 1, "baa"),
+    )
+
+class DeletedLinesEndTheLineBefore(_Base, unittest.TestCase):
+    a = "a\nbbcc\n\ncb\n\n \n"
+    b = "a\nbbcc\n\n \n"
+
+    wanted = (
+        ("D", 1, 4, "\n"),
+        ("D", 1, 4, "\n"),
+        ("D", 1, 4, "cb"),
+    )
+
+class TimeoutFallsBackToCoarseEdit(unittest.TestCase):
+    def runTest(self):
+        a = "first\nxaybz"
+        b = "first\nxbyaz"
+        fallbacks = _diff.counts["fallback"]
+        es = diff(a, b, 0, 0)
+        self.assertEqual(b, transform(a, es))
+        self.assertEqual((
+            ("D", 1, 1, "ayb"),
+            ("I", 1, 1, "bya"),
+        ), es)
+        self.assertEqual(fallbacks + 1, _diff.counts["fallback"])
+
+        timeout, _diff.TIMEOUT = _diff.TIMEOUT, 0
+        try:
+            self.assertEqual(es, diff(a, b))
+        finally:
+            _diff.TIMEOUT = timeout
+        self.assertEqual(fallbacks + 2, _diff.counts["fallback"])
+        diff(a, b)
+        self.assertEqual(fallbacks + 2, _diff.counts["fallback"])
+
+class TimeoutFallsBackToBitParallel(unittest.TestCase):
+    def runTest(self):
+        a = "abc" * 500
+        b = "acb" * 500
+        counts = dict(_diff.counts)
+        es = diff(a, b)
+        self.assertEqual(b, transform(a, es))
+        self.assertEqual(counts["bit_parallel"] + 1,
+                _diff.counts["bit_parallel"])
+        self.assertEqual(counts["fallback"], _diff.counts["fallback"])
+        self.assertFalse(any(len(cmd[3]) > 3 for cmd in es))
+
+class TimeoutBoundsBothEngines(unittest.TestCase):
+    def runTest(self):
+        rand = random.Random(42)
+        a = "".join(rand.choice("abcdef \n") for i in range(50000))
+        unrelated = "".join(rand.choice("abcdef \n") for i in range(50000))
+        scattered = list(a)
+        for i in range(2000):
+            scattered[rand.randrange(len(a))] = "X"
+        for b in (unrelated, "".join(scattered)):
+            start = time.time()
+            diff(a, b, 0, 0.2)
+            # Leave a bit of room for a slow or busy machine.
+            self.assertLess(time.time() - start, 0.25)
+
+class EveryLineChanges(unittest.TestCase):
+    def runTest(self):
+        a = "\n".join("    foo line %i = foo(x)" % i for i in range(400))
+        for b in (a.replace("foo", "bar"),
+                a.replace("foo", "bar").replace("line 20", "new\nline 20")):
+            fallbacks = _diff.counts["fallback"]
+            es = diff(a, b, 0, 1)
+            self.assertEqual(b, transform(a, es))
+            self.assertEqual(fallbacks, _diff.counts["fallback"])
+            self.assertFalse(any("line" in cmd[3] for cmd in es))
+
+class BitParallelEngine(unittest.TestCase):
+    def runTest(self):
+        for case in _Base.__subclasses__():
+            es = diff(case.a, case.b, engine="bit_parallel")
+            self.assertEqual(case.wanted, es)
+
+class CompleteEditTouchesOnlyEditedLines(unittest.TestCase):
+    def runTest(self):
+        a = ["line %i" % i for i in range(200)]
+        b = a[:100] + ["line 1", "00x"] + a[101:198] + ["line 198line 199"]
+        es = (
+            ("I", 105, 6, "\n"),
+            ("I", 106, 2, "x"),
+            ("D", 204, 8, "\n"),
+        )
+        self.assertTrue(is_complete_edit(5, a, b, es))
+        self.assertFalse(is_complete_edit(5, a, b[:-1], es))
+        self.assertTrue(is_complete_edit(5, ["x"], [""], (("D", 5, 1, "\n"),)))
+        self.assertRaises(IndexError, is_complete_edit, 5, a, b,
+                (("I", 205, 0, "x"),))
+
 
 if __name__ == '__main__':
    unittest.main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import os.path as p, sys; sys.path.append(p.join(p.dirname(__file__), ".."))
+
+from _file_tracker import DirectoryCache
+
+
+class _DirectoryCacheBase(object):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix="UltiSnips_Test")
+        self.cache = DirectoryCache()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _touch(self, name):
+        open(os.path.join(self.dir, name), "w").close()
+
+    def _rename_keeping_mtime(self, old, new, mtime):
+        """ Changes the directory without changing its signature, like a
+        second change in the same clock tick would. """
+        os.rename(os.path.join(self.dir, old), os.path.join(self.dir, new))
+        os.utime(self.dir, (mtime, mtime))
+
+class DirectoryCache_ListsRecentlyModifiedDirectoriesAgain(
+        _DirectoryCacheBase, unittest.TestCase):
+    def runTest(self):
+        self._touch("a.snippets")
+        mtime = int(time.time())
+        os.utime(self.dir, (mtime, mtime))
+        self.assertEqual(["a.snippets"], self.cache.listdir(self.dir))
+
+        self._rename_keeping_mtime("a.snippets", "b.snippets", mtime)
+        self.assertEqual(["b.snippets"], self.cache.listdir(self.dir))
+        self.assertEqual([os.path.join(self.dir, "b.snippets")],
+                self.cache.glob(self.dir, "*.snippets"))
+
+class DirectoryCache_TrustsOldModificationTimes(
+        _DirectoryCacheBase, unittest.TestCase):
+    def runTest(self):
+        self._touch("a.snippets")
+        mtime = int(time.time()) - 3600
+        os.utime(self.dir, (mtime, mtime))
+        self.assertEqual(["a.snippets"], self.cache.listdir(self.dir))
+
+        self._rename_keeping_mtime("a.snippets", "b.snippets", mtime)
+        self.assertEqual(["a.snippets"], self.cache.listdir(self.dir))
+
+        os.utime(self.dir, None)
+        self.assertEqual(["b.snippets"], self.cache.listdir(self.dir))
+
+class DirectoryCache_MissingDirectories(_DirectoryCacheBase, unittest.TestCase):
+    def runTest(self):
+        missing = os.path.join(self.dir, "missing")
+        self.assertEqual(None, self.cache.listdir(missing))
+        self.assertEqual([], self.cache.glob(missing, "*.snippets"))
+        os.mkdir(missing)
+        self.assertEqual([], self.cache.listdir(missing))
+
+
+if __name__ == '__main__':
+   unittest.main()
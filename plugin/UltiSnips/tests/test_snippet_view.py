@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import itertools
+import random
+import unittest
+
+import os.path as p, sys; sys.path.append(p.join(p.dirname(__file__), ".."))
+
+from _snippet_view import ResolvedView
+
+_generations = itertools.count(1)
+
+class _Snippet(object):
+    def __init__(self, trigger, overwrites_previous):
+        self.trigger = trigger
+        self.overwrites_previous = overwrites_previous
+
+    def __repr__(self):
+        return "_Snippet(%r, %r)" % (self.trigger, self.overwrites_previous)
+
+class _Dictionary(object):
+    """ Just enough of _SnippetDictionary for ResolvedView. """
+
+    def __init__(self):
+        self.snippets = []
+        self._extends = []
+        self._changed()
+
+    def _changed(self):
+        self.generation = next(_generations)
+
+    def add_snippet(self, s):
+        self.snippets.append(s)
+        self._changed()
+
+    def add_extends(self, ft):
+        if ft not in self._extends:
+            self._extends.append(ft)
+            self._changed()
+
+    @property
+    def extends(self):
+        return self._extends
+
+    @property
+    def end_chars(self):
+        return frozenset(s.trigger[-1] for s in self.snippets)
+
+    def get_matching_snippets(self, before, possible):
+        if possible:
+            return [ s for s in self.snippets if s.trigger.startswith(before) ]
+        return [ s for s in self.snippets if s.trigger == before ]
+
+def _find_snippets(dictionaries, ft, before, possible, seen=None):
+    """ How the manager looked up snippets before ResolvedView. """
+    sd = dictionaries.get(ft)
+    if not sd:
+        return []
+    if not seen:
+        seen = []
+    seen.append(ft)
+    parent_results = []
+    for parent in sd.extends:
+        if parent not in seen:
+            seen.append(parent)
+            parent_results += _find_snippets(dictionaries, parent, before,
+                    possible, seen)
+    return parent_results + sd.get_matching_snippets(before, possible)
+
+def _snips(dictionaries, filetypes, before, possible):
+    found_snippets = []
+    for ft in filetypes[::-1]:
+        found_snippets += _find_snippets(dictionaries, ft, before, possible)
+
+    snippets = {}
+    for s in found_snippets:
+        if (s.trigger not in snippets) or s.overwrites_previous:
+            snippets[s.trigger] = []
+        snippets[s.trigger].append(s)
+    selected_snippets = set([item for sublist in snippets.values()
+        for item in sublist])
+    return [snip for snip in found_snippets if snip in selected_snippets]
+
+
+class ResolvedView_AgreesWithLookingUpEveryTime(unittest.TestCase):
+    filetypes = ("all", "a", "b", "c")
+
+    def _change(self, rand, dictionaries):
+        ft = rand.choice(self.filetypes)
+        sd = dictionaries.get(ft)
+        if sd is None:
+            dictionaries[ft] = _Dictionary()
+        elif rand.random() < 0.3:
+            sd.add_extends(rand.choice(self.filetypes))
+        else:
+            sd.add_snippet(_Snippet(rand.choice(("x", "xy", "y")),
+                rand.random() < 0.3))
+
+    def runTest(self):
+        rand = random.Random(42)
+        for i in range(200):
+            dictionaries = {}
+            views = {}
+            for j in range(30):
+                self._change(rand, dictionaries)
+                chain = tuple(rand.sample(self.filetypes,
+                    rand.randint(1, len(self.filetypes))))
+                view = views.get(chain)
+                if view is None or not view.is_valid(dictionaries):
+                    view = views[chain] = ResolvedView(chain, dictionaries)
+                for before in ("", "x", "xy", "y"):
+                    for possible in (False, True):
+                        self.assertEqual(
+                            _snips(dictionaries, chain, before, possible),
+                            view.matching(before, possible))
+                    if before and not view.could_expand(before):
+                        self.assertEqual([],
+                                _snips(dictionaries, chain, before, False))
+
+class ResolvedView_Invalidation(unittest.TestCase):
+    def runTest(self):
+        html, all_ = _Dictionary(), _Dictionary()
+        html.add_extends("xml")
+        dictionaries = { "all": all_, "html": html }
+        view = ResolvedView(("all", "html"), dictionaries)
+        self.assertTrue(view.is_valid(dictionaries))
+
+        all_.add_snippet(_Snippet("x", False))
+        self.assertFalse(view.is_valid(dictionaries))
+
+        view = ResolvedView(("all", "html"), dictionaries)
+        self.assertTrue(view.is_valid(dictionaries))
+        dictionaries["xml"] = _Dictionary()
+        self.assertFalse(view.is_valid(dictionaries))
+
+        view = ResolvedView(("all", "html"), dictionaries)
+        dictionaries["css"] = _Dictionary()
+        self.assertTrue(view.is_valid(dictionaries))
+        dictionaries["css"].add_snippet(_Snippet("x", False))
+        self.assertTrue(view.is_valid(dictionaries))
+
+
+if __name__ == '__main__':
+   unittest.main()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import random
+import re
+import unittest
+
+import os.path as p, sys; sys.path.append(p.join(p.dirname(__file__), ".."))
+
+from _trigger_index import TriggerIndex, words_for_line
+
+
+class _Snippet(object):
+    """ The matching rules of UltiSnips.Snippet, without Vim. """
+
+    def __init__(self, trigger, opts):
+        self.trigger = trigger
+        self._opts = opts
+
+    def __repr__(self):
+        return "_Snippet(%r, %r)" % (self.trigger, self._opts)
+
+    def has_option(self, opt):
+        return opt in self._opts
+
+    def _words_for_line(self, before):
+        return words_for_line(before, len(self.trigger.split()))
+
+    def _re_match(self, before):
+        try:
+            regex = re.compile(self.trigger)
+        except Exception:
+            return False
+        for match in regex.finditer(before):
+            if match.end() == len(before):
+                return True
+        return False
+
+    def matches(self, before):
+        if before and before.rstrip() != before:
+            return False
+        words = self._words_for_line(before)
+        t = self.trigger
+        if "r" in self._opts:
+            return self._re_match(before)
+        elif "w" in self._opts:
+            prefix, suffix = words[:-len(t)], words[-len(t):]
+            if suffix != t:
+                return False
+            return not prefix or bool(re.match(r'.\b.', prefix[-1] + t[0]))
+        elif "i" in self._opts:
+            return words.endswith(t)
+        return words == t
+
+    def could_match(self, before):
+        if before and before[-1] in (" ", "\t"):
+            before = ""
+        if before and before.rstrip() is not before:
+            return False
+        words = self._words_for_line(before)
+        if "r" in self._opts:
+            return self._re_match(before)
+        elif "w" in self._opts:
+            if re.sub(r'^.+\b(.+)$', r'\1', words) != words:
+                return False
+        return self.trigger.startswith(words)
+
+
+class _TriggerIndexBase(object):
+    """ Compares TriggerIndex.candidates with asking every snippet. """
+    alphabet = "ab-"
+    options = ("",)
+
+    def _random_text(self, rand, max_len):
+        return "".join(rand.choice(self.alphabet + " ")
+            for i in range(rand.randint(0, max_len)))
+
+    def _random_trigger(self, rand):
+        trigger = self._random_text(rand, 5).strip()
+        return " ".join(trigger.split()) or rand.choice(self.alphabet)
+
+    def _snippets(self, rand):
+        return [ _Snippet(self._random_trigger(rand), rand.choice(self.options))
+            for i in range(rand.randint(1, 12)) ]
+
+    def _check(self, index, snippets, before):
+        end_chars = index.end_chars
+        if end_chars is not None and any(s.matches(before) for s in snippets):
+            self.assertTrue(before[-1:] in end_chars,
+                "%r can not end in %r" % (before, end_chars))
+        for potentially in (False, True):
+            candidates = index.candidates(before, potentially)
+            ranks = [ index.rank(s) for s in candidates ]
+            self.assertEqual(sorted(ranks), ranks)
+            self.assertEqual(len(set(candidates)), len(candidates))
+            for s in snippets:
+                if potentially:
+                    wanted = s.could_match(before)
+                else:
+                    wanted = s.matches(before)
+                if wanted:
+                    self.assertTrue(s in candidates,
+                        "%r missing for %r (potentially=%r)" %
+                        (s, before, potentially))
+
+    def runTest(self):
+        rand = random.Random(42)
+        for i in range(300):
+            snippets = self._snippets(rand)
+            index = TriggerIndex()
+            for rank, s in enumerate(snippets):
+                index.add(s, rank)
+            for j in range(20):
+                self._check(index, snippets, self._random_text(rand, 8))
+
+            # Removing snippets must not lose the others
+            removed = snippets[::2]
+            for s in removed:
+                index.remove(s)
+            snippets = snippets[1::2]
+            self.assertEqual(len(snippets), len(index))
+            for j in range(20):
+                before = self._random_text(rand, 8)
+                self._check(index, snippets, before)
+                for s in removed:
+                    self.assertFalse(s in index.candidates(before, False))
+
+class TriggerIndex_PlainTriggers(_TriggerIndexBase, unittest.TestCase):
+    options = ("", "b")
+
+class TriggerIndex_InwordTriggers(_TriggerIndexBase, unittest.TestCase):
+    alphabet = "ab-."
+    options = ("w", "i", "wi", "wb")
+
+class TriggerIndex_SuffixCandidates(unittest.TestCase):
+    def runTest(self):
+        index = TriggerIndex()
+        w, i, multi = (_Snippet("ab", "w"), _Snippet("ab", "i"),
+                _Snippet("a b", "w"))
+        for rank, s in enumerate((w, i, multi)):
+            index.add(s, rank)
+        self.assertEqual([w, i, multi], index.candidates("x.ab", False))
+        self.assertEqual([i, multi], index.candidates("xab", False))
+        self.assertEqual([multi], index.candidates("xb", False))
+
+class TriggerIndex_RegexTriggers(_TriggerIndexBase, unittest.TestCase):
+    patterns = (
+        r"a", r"b+", r"a|b", r"^a", r"-$", r"(a)(b)?", r"(a)\1", r"(?i)A",
+        r"(?P<x>b)", r"a(?=b)", r"(?<=a)b", r"[", r"(a" * 45 + ")" * 45,
+        r"\ba", r"a b",
+    )
+
+    def _snippets(self, rand):
+        rv = _TriggerIndexBase._snippets(self, rand)
+        rv.extend(_Snippet(rand.choice(self.patterns), "r")
+            for i in range(rand.randint(1, 6)))
+        rand.shuffle(rv)
+        return rv
+
+class TriggerIndex_EndChars(unittest.TestCase):
+    def runTest(self):
+        index = TriggerIndex()
+        ab, b, regex = (_Snippet("ab", ""), _Snippet("b", "w"),
+                _Snippet("a", "r"))
+        for rank, s in enumerate((ab, b)):
+            index.add(s, rank)
+        self.assertEqual(frozenset("b"), index.end_chars)
+        index.add(regex, 2)
+        self.assertEqual(None, index.end_chars)
+        index.remove(regex)
+        index.remove(ab)
+        self.assertEqual(frozenset("b"), index.end_chars)
+        index.remove(b)
+        self.assertEqual(frozenset(), index.end_chars)
+
+class TriggerIndex_ExactCandidates(unittest.TestCase):
+    def runTest(self):
+        index = TriggerIndex()
+        a, ab, ab2, multi = (_Snippet("a", ""), _Snippet("ab", ""),
+                _Snippet("ab", ""), _Snippet("a b", ""))
+        for rank, s in enumerate((ab2, a, multi, ab)):
+            index.add(s, rank)
+        self.assertEqual([ab2, ab], index.candidates("x ab", False))
+        self.assertEqual([multi], index.candidates("x a b", False))
+        self.assertEqual([], index.candidates("ab ", False))
+        self.assertEqual([ab2, ab], index.candidates("ab", True))
+        self.assertEqual([ab2, a, multi, ab], index.candidates("ab ", True))
+
+
+if __name__ == '__main__':
+   unittest.main()
@@ -188,6 +188,7 @@ class PythonCode(NoneditableTextObject):
         self._globals = {}
         globals = snippet.globals.get("!p", [])
         compatible_exec("\n".join(globals).replace("\r\n", "\n"), self._globals)
+        _vim.forget_snapshot()
 
         # Add Some convenience to the code
         self._code = "import re, os, vim, string, random\n" + code
@@ -214,6 +215,7 @@ class PythonCode(NoneditableTextObject):
         })
 
         compatible_exec(self._code, self._globals, local_d)
+        _vim.forget_snapshot()
 
         rv = as_unicode(
             self._snip.rv if self._snip._rv_changed
@@ -12,6 +12,9 @@ class VimLCode(NoneditableTextObject):
         NoneditableTextObject.__init__(self, parent, token)
 
     def _update(self, done, not_done):
-        self.overwrite(_vim.eval(self._code))
+        rv = _vim.eval(self._code)
+        # The expression might call functions that change the state of Vim.
+        _vim.forget_snapshot()
+        self.overwrite(rv)
         return True
 
@@ -14,10 +14,7 @@ class IndentUtil(object):
 
     def reset(self):
         """ Gets the spacing properties from Vim. """
-        self.sw = int(_vim.eval("&sw"))
-        self.sts = int(_vim.eval("&sts"))
-        self.et = (_vim.eval("&expandtab") == "1")
-        self.ts = int(_vim.eval("&ts"))
+        self.sw, self.sts, self.et, self.ts = _vim.indent_settings()
 
     def ntabs_to_proper_indent(self, ntabs):
         line_ind = ntabs * self.sw * " "
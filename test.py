@@ -30,6 +30,7 @@
 # <F13> when you send a | symbol while using german key mappings)
 
 import os
+import shutil
 import tempfile
 import unittest
 import time
@@ -1123,6 +1124,32 @@ End""")
     i1
     End"""
 
+class PythonCode_IndentSwChangedBetweenExpansions(_VimTest):
+    def _options_on(self):
+        self.send(":set sw=3\n")
+        self.send(":set expandtab\n")
+    def _options_off(self):
+        self.send(":set sw=8\n")
+        self.send(":set noexpandtab\n")
+    snippets = ("test", r"""`!p snip.rv = "a"
+snip >> 1
+snip += "b"`""")
+    keys = "test" + EX + ESC + ":set sw=2\n" + "o" + ESC + "itest" + EX
+    wanted = "a\n   b\na\n  b"
+
+class PythonCode_IndentSwChangedInSnippet(_VimTest):
+    def _options_on(self):
+        self.send(":set sw=3\n")
+        self.send(":set expandtab\n")
+    def _options_off(self):
+        self.send(":set sw=8\n")
+        self.send(":set noexpandtab\n")
+    snippets = ("test", r"""$1`!p snip.rv = ":"
+snip >> 1
+snip += t[1]`""")
+    keys = "test" + EX + "x" + ESC + ":set sw=2\n" + "ay"
+    wanted = "xy:\n  xy"
+
 class PythonCode_IndentNoetSwTs(_VimTest):
     def _options_on(self):
         self.send(":set sw=3\n")
@@ -1405,6 +1432,19 @@ class Mirror_TestKillTabstop_Kill(_VimTest):
     keys = "hallo test" + EX + "elt"
     wanted = "hallo weltelt "
 
+class Mirror_CursorMovesOnly_ExceptCorrectResult(_VimTest):
+    snippets = "test", "$1 $1"
+    keys = "test" + EX + "hello" + 2*ARR_L + 2*ARR_R + " world"
+    wanted = "hello world hello world"
+class Mirror_EditAfterCursorMoves_ExceptCorrectResult(_VimTest):
+    snippets = "test", "$1 $1"
+    keys = "test" + EX + "hllo" + 3*ARR_L + "e" + ARR_R + ARR_L + "_"
+    wanted = "he_llo he_llo"
+class Mirror_EditInNormalMode_ExceptCorrectResult(_VimTest):
+    snippets = "test", "$1 $1"
+    keys = "test" + EX + "hello" + ESC + "hx" + "i_"
+    wanted = "hel_o hel_o"
+
 # End: Mirrors  #}}}
 # Transformations  {{{#
 class Transformation_SimpleCase_ExceptCorrectResult(_VimTest):
@@ -2545,6 +2585,23 @@ hi4Hello"""
     def _options_off(self):
         self.send(":set langmap=\n")
 
+class TestLangmapThatIsNotItsOwnInverse_ExceptCorrectResult(_VimTest):
+    snippets = ("testme",
+"""my snipped ${1:some_default}
+and a mirror: $1
+$2...$3
+$0""")
+    keys = "testme" + EX + "hi1" + JF + "hi2" + JF + "hi3" + JF + "hi4"
+    wanted ="""my snipped hi1
+and a mirror: hi1
+hi2...hi3
+hi4"""
+
+    def _options_on(self):
+        self.send(":set langmap=hjkl;jklh,HJKL;JKLH\n")
+    def _options_off(self):
+        self.send(":set langmap=\n")
+
 # Test for bug 871357 #
 class TestLangmapWithUtf8_ExceptCorrectResult(_VimTest):
     skip_on_windows = True   # SendKeys can't send UTF characters
@@ -3032,6 +3089,88 @@ class DeleteCurrentTabStop3_JumpAround(_VimTest):
     wanted = "hello\nendworld"
 
 # End: Normal mode editing  #}}}
+# Snippet Files On Disk  {{{#
+def _write_snippet_file(name, *lines):
+    """ Keys that make Vim write a snippet file into the test directory. """
+    return ":call writefile(%r, g:snippet_test_dir . '/%s')\n" % (
+            list(lines), name)
+
+class _SnippetFilesOnDisk(_VimTest):
+    snippet_files = ()
+
+    def _options_on(self):
+        self._rtp = tempfile.mkdtemp(prefix="UltiSnips_Test")
+        snippet_dir = os.path.join(self._rtp, "TestSnippets")
+        os.mkdir(snippet_dir)
+        for name, content in self.snippet_files:
+            with open(os.path.join(snippet_dir, name), "w") as f:
+                f.write(dedent(content))
+        self.send(":let g:snippet_test_dir = '%s'\n" % snippet_dir)
+        self.send(":let g:UltiSnipsSnippetDirectories = ['TestSnippets']\n")
+        self.send(":set rtp+=%s\n" % self._rtp)
+
+    def _options_off(self):
+        self.send(":set rtp-=%s\n" % self._rtp)
+        self.send(":unlet g:snippet_test_dir\n")
+        shutil.rmtree(self._rtp)
+
+class SnippetFile_EditedFile_ExpandsNewContent(_SnippetFilesOnDisk):
+    snippet_files = (("all.snippets", """\
+        snippet test
+        first
+        endsnippet
+        """),)
+    keys = "test" + EX + ESC + \
+            _write_snippet_file("all.snippets",
+                "snippet test", "second", "endsnippet") + \
+            "o" + ESC + "itest" + EX
+    wanted = "first\nsecond"
+
+class SnippetFile_EditedFile_OtherFileKeepsSnippets(_SnippetFilesOnDisk):
+    snippet_files = (("all.snippets", """\
+        snippet a
+        A1
+        endsnippet
+        """), ("all_b.snippets", """\
+        snippet b
+        B
+        endsnippet
+        """))
+    keys = "a" + EX + ESC + \
+            _write_snippet_file("all.snippets",
+                "snippet a", "A two", "endsnippet") + \
+            "o" + ESC + "ib" + EX + ESC + "o" + ESC + "ia" + EX
+    wanted = "A1\nB\nA two"
+
+class SnippetFile_EditedFile_SnippetRemoved(_SnippetFilesOnDisk):
+    snippet_files = (("all.snippets", """\
+        snippet test
+        first
+        endsnippet
+
+        snippet other
+        other
+        endsnippet
+        """),)
+    keys = "test" + EX + ESC + \
+            _write_snippet_file("all.snippets",
+                "snippet other", "changed", "endsnippet") + \
+            "o" + ESC + "iother" + EX + ESC + "o" + ESC + "itest" + EX
+    wanted = "first\nchanged\ntest" + EX
+
+class SnippetFile_NewFile_ExpandsItsSnippets(_SnippetFilesOnDisk):
+    snippet_files = (("all.snippets", """\
+        snippet test
+        first
+        endsnippet
+        """),)
+    keys = "test" + EX + ESC + \
+            _write_snippet_file("all_new.snippets",
+                "snippet new", "from the new file", "endsnippet") + \
+            "o" + ESC + "inew" + EX
+    wanted = "first\nfrom the new file"
+
+# End: Snippet Files On Disk  #}}}
 
 class VerifyVimDict1(_VimTest):
     """check:
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+The Python side of bench_diff.vim. The texts are made up of words that are
+common in snippets, so that there are plenty of accidental matches. Each
+engine in _diff.ENGINES is timed on the same texts.
+"""
+
+import os
+import random
+import sys
+import time
+
+import vim
+
+from UltiSnips import _diff
+
+_WORDS = ("def", "return", "self", "value", "snippet", "tabstop", "for",
+        "in", "if", "else", "(", ")", ":")
+
+def _text(rand, n):
+    rv = ""
+    while len(rv) < n:
+        rv += rand.choice(_WORDS) + rand.choice("  \n")
+    return rv[:n]
+
+def _paste(rand, a):
+    middle = len(a) // 2
+    return a[:middle] + _text(rand, len(a) // 2) + a[middle:]
+
+def _scatter(rand, a):
+    b = list(a)
+    for i in range(len(a) // 20 + 1):
+        b[rand.randrange(len(b))] = rand.choice("XYZ")
+    return "".join(b)
+
+def _unrelated(rand, a):
+    return _text(rand, len(a))
+
+def _lines(rand, n):
+    return "\n".join("    " + " ".join(rand.choice(_WORDS) for i in range(6))
+            for j in range(n))
+
+def _move_line(rand, a):
+    lines = a.split("\n")
+    lines.insert(len(lines) // 2, lines.pop(1))
+    return "\n".join(lines)
+
+def _substitute(rand, a):
+    return a.replace("self", "this")
+
+def _edit_every_line(rand, a):
+    return "\n".join(line[:6] + rand.choice(_WORDS) + line[6:]
+            for line in a.split("\n"))
+
+def _test_corpus():
+    """ The texts of the diff test cases in plugin/UltiSnips/tests. """
+    tests = os.path.join(os.path.dirname(_diff.__file__), "tests")
+    sys.path.insert(0, tests)
+    try:
+        import test_diff
+    finally:
+        sys.path.remove(tests)
+    return [ (case.a, case.b) for case in test_diff._Base.__subclasses__() ]
+
+def _time(engine, pairs):
+    """ Returns the time it takes engine to diff all pairs once. """
+    repeats = 0
+    start = time.time()
+    while True:
+        for a, b in pairs:
+            _diff.diff(a, b, engine=engine)
+        repeats += 1
+        elapsed = time.time() - start
+        if elapsed > 0.2:
+            return elapsed / repeats
+
+def _cases(rand, sizes):
+    yield "test_diff.py corpus", None, _test_corpus()
+    for n in sizes:
+        a = _text(rand, n)
+        for label, edit in (("paste", _paste), ("scattered", _scatter),
+                ("unrelated", _unrelated)):
+            yield label, "%i chars" % n, [(a, edit(rand, a))]
+    for n in sizes:
+        a = _lines(rand, n // 10)
+        for label, edit in (("dd+p", _move_line), (":s", _substitute),
+                ("edit every line", _edit_every_line)):
+            yield label, "%i lines" % (n // 10), [(a, edit(rand, a))]
+
+def run(sizes):
+    rand = random.Random(42)
+    engines = sorted(_diff.ENGINES)
+    results = ["%-30s" % "" + "".join("%14s" % e for e in engines)]
+    timeout, _diff.TIMEOUT = _diff.TIMEOUT, None
+    try:
+        for label, size, pairs in _cases(rand, sizes):
+            if size:
+                label += ", " + size
+            results.append("%-30s" % label + "".join("%11.3f ms" %
+                (_time(engine, pairs) * 1e3) for engine in engines))
+    finally:
+        _diff.TIMEOUT = timeout
+    for line in results:
+        vim.command("echomsg '%s'" % line)
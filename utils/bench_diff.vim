@@ -0,0 +1,18 @@
+" Times each engine of the diff that UltiSnips falls back to when it cannot
+" guess what the user did inside a snippet. The engines diff the texts of
+" tests/test_diff.py and texts of growing size with three kinds of edits: a
+" paste into the middle, scattered single character changes and a complete
+" replacement by unrelated text. Texts of a tenth as many lines are timed for
+" a line moved with dd and p and for a :s on all lines.
+"
+" Usage: vim -u NONE -N -S utils/bench_diff.vim
+" The results are shown at the end and can be seen again with :messages.
+
+let s:here = expand("<sfile>:p:h")
+exec "set runtimepath^=" . fnameescape(fnamemodify(s:here, ":h"))
+runtime plugin/UltiSnips.vim
+let s:py = g:_uspy
+
+exec s:py "sys.path.insert(0, vim.eval('s:here'))"
+exec s:py "import bench_diff"
+exec s:py "bench_diff.run([50, 100, 200, 400, 800, 1600])"
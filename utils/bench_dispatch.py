@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+The Python side of bench_dispatch.vim. The entry points do nothing, so only
+the cost of getting there is measured.
+"""
+
+import vim
+
+class _Bench(object):
+    def cursor_moved(self):
+        pass
+
+    def add_snippet(self, trigger, value, descr, options, ft="all",
+            globals=None):
+        pass
+
+bench = _Bench()
+_entry_points = {
+    "cursor_moved": bench.cursor_moved,
+    "add_snippet": bench.add_snippet,
+}
+
+def bench_call():
+    name, args = vim.eval("l:call")
+    _entry_points[name](*args)
+    return ""
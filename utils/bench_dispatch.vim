@@ -0,0 +1,54 @@
+" Measures the per call overhead of getting from a Vim function into Python,
+" the way plugin/UltiSnips.vim used to do it (one :py command string per call
+" and one vim.eval per argument) and the way it does it now (pyeval() of a
+" pre-bound function that fetches all arguments with one vim.eval).
+"
+" Usage: vim -u NONE -N -S utils/bench_dispatch.vim
+" The results are shown at the end and can be seen again with :messages.
+
+let s:py = has("python3") ? "py3" : "py"
+let s:pyeval = s:py . "eval"
+exec s:py . "file " . fnameescape(expand("<sfile>:p:h") . "/bench_dispatch.py")
+
+function! s:OldNoArgs()
+    exec s:py "bench.cursor_moved()"
+    return ""
+endfunction
+
+function! s:NewNoArgs()
+    let l:call = ["cursor_moved", []]
+    return call(s:pyeval, ["bench_call()"])
+endfunction
+
+function! s:OldArgs(trigger, value, descr, options, ...)
+    exec s:py "args = vim.eval(\"a:000\")"
+    exec s:py "trigger = vim.eval(\"a:trigger\")"
+    exec s:py "value = vim.eval(\"a:value\")"
+    exec s:py "descr = vim.eval(\"a:descr\")"
+    exec s:py "options = vim.eval(\"a:options\")"
+    exec s:py "bench.add_snippet(trigger, value, descr, options, *args)"
+    return ""
+endfunction
+
+function! s:NewArgs(trigger, value, descr, options, ...)
+    let l:call = ["add_snippet", [a:trigger, a:value, a:descr, a:options] + a:000]
+    return call(s:pyeval, ["bench_call()"])
+endfunction
+
+function! s:Time(name, func, args, n)
+    let l:start = reltime()
+    let l:i = 0
+    while l:i < a:n
+        call call(a:func, a:args)
+        let l:i += 1
+    endwhile
+    let l:us = str2float(reltimestr(reltime(l:start))) * 1000000 / a:n
+    echomsg printf("%-36s %8.2f us per call", a:name, l:us)
+endfunction
+
+let s:n = 20000
+let s:args = ["trig", "value ${1}", "description", "b", "all"]
+call s:Time("no arguments, exec :" . s:py, function("s:OldNoArgs"), [], s:n)
+call s:Time("no arguments, " . s:pyeval . "()", function("s:NewNoArgs"), [], s:n)
+call s:Time("5 arguments, exec :" . s:py, function("s:OldArgs"), s:args, s:n)
+call s:Time("5 arguments, " . s:pyeval . "()", function("s:NewArgs"), s:args, s:n)
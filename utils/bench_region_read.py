@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+The Python side of bench_region_read.vim. Reads a region of the current
+buffer through UltiSnips' buffer wrapper and counts how often Python asks
+Vim to evaluate an expression while doing so.
+"""
+
+import time
+
+import vim
+
+from UltiSnips import compatibility
+import UltiSnips._vim as _vim
+
+class _CountingEval(object):
+    def __init__(self, real):
+        self.real = real
+        self.calls = 0
+
+    def __call__(self, expr):
+        self.calls += 1
+        return self.real(expr)
+
+def run(nlines, repeats):
+    counter = _CountingEval(vim.eval)
+    vim.eval = counter
+    results = []
+    try:
+        for label, cache in (("&encoding per conversion", False),
+                ("cached &encoding", True)):
+            compatibility._can_cache_codec = cache
+            compatibility.encoding_changed()
+            _vim.buf[0:nlines] # Warm up
+            counter.calls = 0
+            start = time.time()
+            for i in range(repeats):
+                _vim.buf[0:nlines]
+            elapsed = time.time() - start
+            results.append("%-26s %6.1f evals, %8.2f us per %i line read" % (
+                label, counter.calls / float(repeats),
+                elapsed * 1e6 / repeats, nlines))
+    finally:
+        vim.eval = counter.real
+        compatibility._can_cache_codec = None
+        compatibility.encoding_changed()
+    for line in results:
+        vim.command("echomsg '%s'" % line)
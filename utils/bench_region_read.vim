@@ -0,0 +1,18 @@
+" Reads a 50 line region of a buffer through UltiSnips the way it does when
+" it looks at the text of a snippet, once evaluating &encoding for every
+" converted line (as UltiSnips used to) and once with the cached codec.
+" Shows the number of Vim evaluations and the time per read.
+"
+" Usage: vim -u NONE -N -S utils/bench_region_read.vim
+" The results are shown at the end and can be seen again with :messages.
+
+let s:here = expand("<sfile>:p:h")
+exec "set runtimepath^=" . fnameescape(fnamemodify(s:here, ":h"))
+runtime plugin/UltiSnips.vim
+let s:py = g:_uspy
+
+call setline(1, map(range(50), '"    line " . v:val . " with some text: äöü"'))
+
+exec s:py "sys.path.insert(0, vim.eval('s:here'))"
+exec s:py "import bench_region_read"
+exec s:py "bench_region_read.run(50, 2000)"
@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+The Python side of bench_select_mappings.vim. Runs the removal of Select mode
+mappings that _vim.select does before each tabstop jump. The run with the
+removal switched off shows what the jump costs when UltiSnips does not even
+check whether mappings might have changed.
+"""
+
+import time
+
+import vim
+
+import UltiSnips._vim as _vim
+
+def run(repeats):
+    results = []
+    for label, forget, remove in (
+            ("mappings read every jump", True, 1),
+            ("mappings cached", False, 1),
+            ("removal switched off", False, 0)):
+        vim.command("let g:UltiSnipsRemoveSelectModeMappings = %i" % remove)
+        _vim._smap_states.clear()
+        _vim._unmap_select_mode_mapping() # Warm up
+        _vim.reset_call_counts()
+        start = time.time()
+        for i in range(repeats):
+            if forget:
+                _vim._smap_states.clear()
+            _vim._unmap_select_mode_mapping()
+        elapsed = time.time() - start
+        calls = sum(_vim.call_counts.values())
+        results.append("%-26s %6.1f Vim calls, %8.2f ms per jump" % (
+            label, calls / float(repeats), elapsed * 1e3 / repeats))
+    vim.command("let g:UltiSnipsRemoveSelectModeMappings = 1")
+    for line in results:
+        vim.command("echomsg '%s'" % line)
@@ -0,0 +1,26 @@
+" Defines 500 Select mode mappings that UltiSnips must keep (250 <Plug>
+" mappings and 250 mappings of a plugin in g:UltiSnipsMappingsToIgnore) and
+" measures what removing Select mode mappings costs on a tabstop jump, once
+" looking at all mappings on every jump (as UltiSnips used to), once
+" only after events that might have changed mappings and once with the
+" removal switched off.
+"
+" Usage: vim -u NONE -N -S utils/bench_select_mappings.vim
+" The results are shown at the end and can be seen again with :messages.
+
+let s:here = expand("<sfile>:p:h")
+exec "set runtimepath^=" . fnameescape(fnamemodify(s:here, ":h"))
+runtime plugin/UltiSnips.vim
+let s:py = g:_uspy
+
+let g:UltiSnipsMappingsToIgnore = ["BenchPlugin"]
+let s:i = 0
+while s:i < 250
+    exec "snoremap <Plug>Bench" . s:i . " <Nop>"
+    exec "snoremap ,b" . s:i . " :<C-u>call BenchPlugin()<CR>"
+    let s:i += 1
+endwhile
+
+exec s:py "sys.path.insert(0, vim.eval('s:here'))"
+exec s:py "import bench_select_mappings"
+exec s:py "bench_select_mappings.run(200)"